@@ -1,6 +1,16 @@
-
 import argparse
-from collections import defaultdict
+import array
+import bisect
+import heapq
+import mmap
+import os
+import pandas as pd
+import sys
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from src.shared import logger
 
 ########################################################################################################################
 # Important Words Search
@@ -8,6 +18,8 @@ from collections import defaultdict
 # version 1.0.0
 ########################################################################################################################
 
+CHUNK_SIZE = 1 << 20  # characters read at a time by the streaming search
+
 
 def word_search(text, k):
     """
@@ -26,10 +38,520 @@ def word_search(text, k):
     return important_words
 
 
+@contextmanager
+def _open_text(source):
+    """
+    :param source: path to a text file, '-' for stdin or an open text stream, str or os.PathLike
+    :return stream: readable text stream, files are opened without newline translation so the text matches the file
+    """
+    if isinstance(source, os.PathLike):
+        source = os.fspath(source)
+    if source == '-':
+        yield sys.stdin
+    elif isinstance(source, str):
+        with open(source, encoding='utf-8', newline='') as stream:
+            yield stream
+    else:
+        yield source
+
+
+def iter_word_chunks(stream, chunk_size=CHUNK_SIZE):
+    """
+    Split a text stream on single spaces exactly like str.split(' ') on the whole text, one chunk at a time
+    a word cut by a chunk boundary is carried over and completed by the next chunk
+    :param stream: readable text stream, io.TextIOBase
+    :param chunk_size: characters read at a time, int
+    :return words: generator of word lists, one per chunk
+    """
+    carry = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        words = (carry + chunk).split(' ')
+        carry = words.pop()  # may still continue in the next chunk
+        yield words
+    yield [carry]
+
+
+def word_search_stream(source, k, chunk_size=CHUNK_SIZE):
+    """
+    Streaming word_search, only the counts dict and the first occurrence order are kept in memory
+    :param source: path to a text file, '-' for stdin or an open text stream, str
+    :param k: min number of occurrences, int
+    :param chunk_size: characters read at a time, int
+    :return important_words: same output as word_search on the whole text, list
+    """
+    word_dict = defaultdict(int)
+
+    with _open_text(source) as stream:
+        for words in iter_word_chunks(stream, chunk_size):
+            for word in words:
+                word_dict[word] += 1
+
+    important_words = [key for key in word_dict if word_dict[key] >= k]
+    return important_words
+
+
+
+def _space_aligned_ranges(path, parts):
+    """
+    Split a file into roughly equal byte ranges which each end just after a space, so no word is cut in two
+    a space is a single byte in utf-8 and never part of a multi byte character, so every range decodes on its own
+    :param path: text file, str
+    :param parts: number of ranges to split into, int
+    :return ranges: list of (start, end) offsets in file order
+    """
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as in_file:
+        for part in range(1, parts):
+            offset = max(size * part // parts, boundaries[-1])
+            in_file.seek(offset)
+            while True:
+                block = in_file.read(1 << 16)
+                if not block:
+                    offset = size
+                    break
+                space = block.find(b' ')
+                if space >= 0:
+                    offset += space + 1
+                    break
+                offset += len(block)
+            boundaries.append(offset)
+    boundaries.append(size)
+    ranges = [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+    return ranges or [(0, 0)]
+
+
+def _count_range(path, start, end, last):
+    """
+    Process pool worker, count the words of one byte range
+    :return word_dict: counts in order of first occurrence within the range, dict
+    """
+    with open(path, 'rb') as in_file:
+        in_file.seek(start)
+        words = in_file.read(end - start).decode('utf-8').split(' ')
+    if not last:
+        words.pop()  # the range ends with a space, the next word starts in the next range
+    word_dict = defaultdict(int)
+    for word in words:
+        word_dict[word] += 1
+    return dict(word_dict)
+
+
+def word_search_parallel(path, k, jobs=None):
+    """
+    Map-reduce word_search over a file: space aligned byte ranges are counted in a process pool and the partial
+    counts are merged in file order. Each partial dict is ordered by first occurrence within its range, so merging
+    them in range order rebuilds the first occurrence order of the whole file
+    :param path: utf-8 text file, str
+    :param k: min number of occurrences, int
+    :param jobs: worker processes, defaults to the cpu count, int
+    :return important_words: same output as word_search on the whole text, list
+    """
+    jobs = jobs or os.cpu_count()
+    ranges = _space_aligned_ranges(path, jobs)
+    word_dict = defaultdict(int)
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as executor:
+        futures = [executor.submit(_count_range, path, start, end, index == len(ranges) - 1)
+                   for index, (start, end) in enumerate(ranges)]
+        for future in futures:
+            for word, count in future.result().items():
+                word_dict[word] += count
+
+    important_words = [key for key in word_dict if word_dict[key] >= k]
+    return important_words
+
+
+
+def misra_gries(stream, capacity, chunk_size=CHUNK_SIZE):
+    """
+    Misra-Gries heavy hitters summary of the words of a text stream, using at most <capacity> counters
+    with N words in the stream, every word occurring more than N / (capacity + 1) times keeps a counter and every
+    counter underestimates its word's count by at most N / (capacity + 1)
+    :param stream: readable text stream, io.TextIOBase
+    :param capacity: max number of counters, int
+    :param chunk_size: characters read at a time, int
+    :return counters, total: estimated counts of the candidate words and N, tuple
+    """
+    counters = {}
+    total = 0
+    for words in iter_word_chunks(stream, chunk_size):
+        total += len(words)
+        for word in words:
+            if word in counters:
+                counters[word] += 1
+            elif len(counters) < capacity:
+                counters[word] = 1
+            else:
+                # no free counter, decrement every counter and drop the ones reaching zero
+                counters = {key: count - 1 for key, count in counters.items() if count > 1}
+    return counters, total
+
+
+def word_search_approximate(source, k, capacity=10_000, chunk_size=CHUNK_SIZE):
+    """
+    Bounded memory word_search for inputs with a huge vocabulary, two passes over the input:
+    1. a Misra-Gries summary with at most <capacity> counters finds the candidate words
+    2. the candidates are counted exactly, so every returned word really occurs at least k times
+    Words occurring more than N / (capacity + 1) times (N words in the input) are never missed, so the result
+    equals word_search whenever k > N / (capacity + 1). Below that bound words occurring at least k times may be
+    missed and a warning is logged. Memory is bounded by the capacity and the chunk size
+    :param source: path to a text file or a seekable text stream, str
+    :param k: min number of occurrences, int
+    :param capacity: max number of counters, int
+    :param chunk_size: characters read at a time, int
+    :return important_words: words occurring at least k times in order of first occurrence, list
+    """
+    with _open_text(source) as stream:
+        if not stream.seekable():  # checked before the first pass, the verification pass reads the stream again
+            raise ValueError("the approximate search reads its input twice and needs a seekable file or stream")
+        counters, total = misra_gries(stream, capacity, chunk_size)
+        error_bound = total / (capacity + 1)
+        if k <= error_bound:
+            logger.warning(f"k={k} is within the error bound {error_bound:.1f}, words occurring {k} to "
+                           f"{int(error_bound)} times may be missed, raise the capacity for an exact answer")
+
+        # verification pass, exact counts of the candidates in order of first occurrence
+        stream.seek(0)
+        word_dict = defaultdict(int)
+        for words in iter_word_chunks(stream, chunk_size):
+            for word in words:
+                if word in counters:
+                    word_dict[word] += 1
+
+    important_words = [key for key in word_dict if word_dict[key] >= k]
+    return important_words
+
+
+
+class ImportantWordsTracker:
+    """
+    Incremental word_search over a changing set of space separated documents
+    words are indexed by count in buckets, with the non-empty counts kept sorted, so a threshold query only visits
+    the buckets at or above the threshold and costs the size of its answer, not the size of the vocabulary
+    """
+    def __init__(self, k):
+        """
+        :param k: default min number of occurrences for important_words, int
+        """
+        self.k = k
+        self.counts = {}
+        self._buckets = defaultdict(set)  # count -> words with exactly that count
+        self._levels = []  # sorted counts of the non-empty buckets
+        # word -> positions of its tracked occurrences, oldest first, the first one orders the results like word_search
+        self._positions = {}
+        self._position = 0
+
+    def _move(self, word, old_count, new_count):
+        """move a word between count buckets, creating and dropping bucket levels as needed"""
+        if old_count:
+            bucket = self._buckets[old_count]
+            bucket.discard(word)
+            if not bucket:
+                del self._buckets[old_count]
+                del self._levels[bisect.bisect_left(self._levels, old_count)]
+        if new_count:
+            if new_count not in self._buckets:
+                bisect.insort(self._levels, new_count)
+            self._buckets[new_count].add(word)
+            self.counts[word] = new_count
+        else:
+            del self.counts[word]
+            del self._positions[word]
+
+    def add(self, text):
+        """
+        :param text: document entering the window, str
+        """
+        for word in text.split(' '):
+            count = self.counts.get(word, 0)
+            if not count:
+                self._positions[word] = deque()
+            self._positions[word].append(self._position)
+            self._position += 1
+            self._move(word, count, count + 1)
+
+    def expire(self, text):
+        """
+        Remove a document, the earliest tracked occurrences of its words are dropped so the results keep the order of
+        word_search over the remaining documents when documents expire oldest first, as in SlidingWindowTracker
+        :param text: document leaving the window, must have been added before, str
+        """
+        words = text.split(' ')
+        expired_counts = Counter(words)
+        for word, expired_count in expired_counts.items():  # check everything first so a bad document changes nothing
+            if self.counts.get(word, 0) < expired_count:
+                raise ValueError(f"cannot expire '{word}', it occurs {expired_count} times but "
+                                 f"{self.counts.get(word, 0)} times in the tracked documents")
+        for word in words:
+            self._positions[word].popleft()
+            count = self.counts[word]
+            self._move(word, count, count - 1)
+
+    def important_words(self, k=None):
+        """
+        Words occurring at least k times in the tracked documents, in order of their earliest tracked occurrence
+        :param k: min number of occurrences, defaults to the tracker's k, int
+        :return important_words: list
+        """
+        k = self.k if k is None else k
+        words = [word for count in self._levels[bisect.bisect_left(self._levels, k):] for word in self._buckets[count]]
+        return sorted(words, key=lambda word: self._positions[word][0])
+
+
+class SlidingWindowTracker(ImportantWordsTracker):
+    """ImportantWordsTracker over the last <max_documents> documents and/or the documents of the last <max_seconds>"""
+    def __init__(self, k, max_documents=None, max_seconds=None, clock=time.monotonic):
+        """
+        :param k: default min number of occurrences for important_words, int
+        :param max_documents: number of most recent documents kept in the window, int
+        :param max_seconds: age in seconds after which a document leaves the window, float
+        :param clock: time source used when add and important_words get no timestamp, callable
+        """
+        super().__init__(k)
+        self.max_documents = max_documents
+        self.max_seconds = max_seconds
+        self._clock = clock
+        self._window = deque()  # (timestamp, text) oldest first
+
+    def _evict(self, now):
+        while self._window and (
+                (self.max_documents is not None and len(self._window) > self.max_documents)
+                or (self.max_seconds is not None and now - self._window[0][0] > self.max_seconds)):
+            self.expire(self._window.popleft()[1])
+
+    def add(self, text, timestamp=None):
+        """
+        :param text: new document, str
+        :param timestamp: time of the document, defaults to the clock, float
+        """
+        timestamp = self._clock() if timestamp is None else timestamp
+        super().add(text)
+        self._window.append((timestamp, text))
+        self._evict(timestamp)
+
+    def important_words(self, k=None, now=None):
+        """
+        :param k: min number of occurrences, defaults to the tracker's k, int
+        :param now: current time for the max_seconds window, defaults to the clock, float
+        :return important_words: list
+        """
+        self._evict(self._clock() if now is None else now)
+        return super().important_words(k)
+
+
+
+class WordIndex:
+    """Count the words once, then answer any number of word_search thresholds and top-k queries"""
+    def __init__(self, word_dict):
+        """
+        :param word_dict: word counts in order of first occurrence, dict
+        """
+        self.counts = dict(word_dict)
+        self._first_seen = {word: position for position, word in enumerate(self.counts)}
+        # frequency sorted index, most frequent first, the stable sort keeps ties in first occurrence order
+        self._by_count = sorted(self.counts, key=self.counts.__getitem__, reverse=True)
+        self._negated_counts = [-self.counts[word] for word in self._by_count]  # ascending, for bisect
+
+    @classmethod
+    def from_text(cls, text):
+        """
+        :param text: space separated text, str
+        """
+        word_dict = defaultdict(int)
+        for word in text.split(' '):
+            word_dict[word] += 1
+        return cls(word_dict)
+
+    @classmethod
+    def from_file(cls, source, chunk_size=CHUNK_SIZE):
+        """
+        :param source: path to a text file, '-' for stdin or an open text stream, str
+        :param chunk_size: characters read at a time, int
+        """
+        word_dict = defaultdict(int)
+        with _open_text(source) as stream:
+            for words in iter_word_chunks(stream, chunk_size):
+                for word in words:
+                    word_dict[word] += 1
+        return cls(word_dict)
+
+    def important_words(self, k):
+        """
+        Same answer as word_search, found from the frequency sorted index in time proportional to the answer
+        :param k: min number of occurrences, int
+        :return important_words: words occurring at least k times in order of first occurrence, list
+        """
+        matches = self._by_count[:bisect.bisect_right(self._negated_counts, -k)]
+        return sorted(matches, key=self._first_seen.__getitem__)
+
+    def thresholds(self, ks):
+        """
+        :param ks: min numbers of occurrences, list
+        :return important_words: word_search answer for every k, dict
+        """
+        return {k: self.important_words(k) for k in ks}
+
+    def top_k(self, n):
+        """
+        The n most frequent words, selected with a heap, ties broken by first occurrence
+        :param n: number of words, int
+        :return top_words: (word, count) tuples, most frequent first, list
+        """
+        top_words = heapq.nsmallest(n, self.counts.items(), key=lambda item: (-item[1], self._first_seen[item[0]]))
+        return top_words
+
+
+
+def word_search_batch(documents, k):
+    """
+    word_search for many documents at once, without its per word python loop: each document is counted by
+    collections.Counter, whose counting loop runs in C and which keeps the words in order of first occurrence
+    :param documents: space separated texts, missing documents give an empty result, list or pd.Series
+    :param k: min number of occurrences, int
+    :return important_words: word_search result of every document, a pd.Series on the same index for a Series, list
+    """
+    texts = documents.tolist() if isinstance(documents, pd.Series) else documents
+    important_words = []
+    append = important_words.append
+    for text in texts:
+        if not isinstance(text, str):  # None or NaN
+            append([])
+            continue
+        append([word for word, count in Counter(text.split(' ')).items() if count >= k])
+
+    if isinstance(documents, pd.Series):
+        return pd.Series(important_words, index=documents.index, dtype=object)
+    return important_words
+
+
+def word_search_mmap(path, k, block_size=CHUNK_SIZE):
+    """
+    word_search over a memory mapped utf-8 file, scanning the bytes for spaces one block at a time
+    the words are counted as bytes slices, so neither the decoded text nor a list of all its words is ever built,
+    and only the returned words are decoded
+    :param path: utf-8 text file, str
+    :param k: min number of occurrences, int
+    :param block_size: bytes split at a time, a block is extended to the next space, int
+    :return important_words: same output as word_search on the whole text, list
+    """
+    word_dict = defaultdict(int)
+
+    with open(path, 'rb') as in_file:
+        size = os.fstat(in_file.fileno()).st_size
+        if size == 0:  # an empty file cannot be mapped
+            word_dict[b''] += 1
+        else:
+            with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                position = 0
+                while True:
+                    cut = mapped.find(b' ', min(position + block_size, size))
+                    if cut < 0:
+                        cut = size  # the last block runs to the end of the file
+                    for word in mapped[position:cut].split(b' '):
+                        word_dict[word] += 1
+                    if cut == size:
+                        break
+                    position = cut + 1
+
+    important_words = [key.decode('utf-8') for key in word_dict if word_dict[key] >= k]
+    return important_words
+
+
+
+def _iter_text_words(text, chunk_size=CHUNK_SIZE):
+    """
+    text.split(' ') one slice of the text at a time, a slice is extended to the next space so no word is cut
+    :param text: space separated text, str
+    :param chunk_size: characters split at a time, int
+    :return words: generator of word lists
+    """
+    position = 0
+    while True:
+        cut = text.find(' ', position + chunk_size)
+        if cut < 0:
+            yield text[position:].split(' ')
+            return
+        yield text[position:cut].split(' ')
+        position = cut + 1
+
+
+def phrase_search(text, k, n=2):
+    """
+    Search the text for phrases of n consecutive words occurring at least k times and return them in order of first
+    occurrence, words are joined by single spaces
+    the words are interned to integer ids and each phrase is counted under a rolling key, the phrase's ids as the
+    digits of a base <vocabulary size> number. Updating the key for the next phrase drops the first digit and appends
+    the next id, and since Python ints do not overflow the key is exact, so two phrases never share a key and no
+    tuple or string is built per phrase
+    :param text: text to search, space separated, str
+    :param k: min number of occurrences, int
+    :param n: words per phrase, n=1 gives the word_search answer, int
+    """
+    if n < 1:
+        raise ValueError(f"phrases need at least one word, got n={n}")
+    vocabulary = {}
+    ids = array.array('q')
+    for words in _iter_text_words(text):
+        ids.extend(vocabulary.setdefault(word, len(vocabulary)) for word in words)
+    if len(ids) < n:
+        return []
+
+    base = len(vocabulary)
+    leading = base ** (n - 1)
+    phrase_dict = defaultdict(int)  # key -> count, in order of first occurrence
+    key = 0
+    for position in range(n - 1):
+        key = key * base + ids[position]
+    for word_id in ids[n - 1:]:
+        key = key % leading * base + word_id if n > 1 else word_id
+        phrase_dict[key] += 1
+
+    words = list(vocabulary)  # id -> word
+    important_phrases = []
+    for key in phrase_dict:
+        if phrase_dict[key] >= k:
+            digits = []
+            for _ in range(n):
+                key, word_id = divmod(key, base)
+                digits.append(words[word_id])
+            important_phrases.append(' '.join(reversed(digits)))
+    return important_phrases
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Important Words Search")
     parser.add_argument('-k', '--min_count', type=int, action="store", required=True, help="min occurrences of word")
-    parser.add_argument('-s', '--search_string', type=str, action="store", required=True, help="phrase of words to search")
+    search_input = parser.add_mutually_exclusive_group(required=True)
+    search_input.add_argument('-s', '--search_string', type=str, action="store", help="phrase of words to search")
+    search_input.add_argument('-f', '--input_file', type=str, action="store", help="text file to stream, - for stdin")
+    parser.add_argument('-j', '--jobs', type=int, action="store", default=1, help="worker processes for -f files")
+    parser.add_argument('-a', '--approximate', type=int, action="store", default=None, help="bounded memory search of the -f file (not stdin) with this many counters")
+    parser.add_argument('-p', '--mmap', action="store_true", help="memory map the -f file (not stdin) and count its words as bytes")
+    parser.add_argument('-n', '--ngram', type=int, action="store", default=1, help="search -s (not -f) for phrases of this many words")
     parser_args = parser.parse_args()
-    result = word_search(parser_args.search_string, parser_args.min_count)
\ No newline at end of file
+    if parser_args.input_file == '-' and parser_args.approximate is not None:
+        parser.error("-a reads the -f file twice, stdin can not be re-read")
+    if parser_args.input_file == '-' and parser_args.mmap:
+        parser.error("-p memory maps the -f file, stdin can not be memory mapped")
+    if parser_args.mmap and parser_args.approximate is not None:
+        parser.error("-p and -a are different searches of the -f file, choose one")
+    if parser_args.jobs > 1 and (parser_args.mmap or parser_args.approximate is not None):
+        parser.error("-j only applies to the exact streaming search of the -f file, not to -p or -a")
+    if parser_args.input_file is not None and parser_args.ngram > 1:
+        parser.error("-n phrase search is only supported for -s")
+    if parser_args.input_file is not None and parser_args.mmap:
+        result = word_search_mmap(parser_args.input_file, parser_args.min_count)
+    elif parser_args.input_file is not None and parser_args.approximate is not None:
+        result = word_search_approximate(parser_args.input_file, parser_args.min_count, parser_args.approximate)
+    elif parser_args.input_file is not None and parser_args.input_file != '-' and parser_args.jobs > 1:
+        result = word_search_parallel(parser_args.input_file, parser_args.min_count, parser_args.jobs)
+    elif parser_args.input_file is not None:
+        result = word_search_stream(parser_args.input_file, parser_args.min_count)
+    elif parser_args.ngram > 1:
+        result = phrase_search(parser_args.search_string, parser_args.min_count, parser_args.ngram)
+    else:
+        result = word_search(parser_args.search_string, parser_args.min_count)
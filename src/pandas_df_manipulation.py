@@ -1,24 +1,115 @@
 import argparse
+import hashlib
+import io
+import json
+import numpy as np
+import os
 import pandas as pd
 import re
+from concurrent.futures import ProcessPoolExecutor
+from src.shared import logger, resolve_inputs
 ########################################################################################################################
 # Pandas Dataframe Manipulation
 # Author: Barry Hykes Jr, bhykes@gmail.com
 # version 1.0.0
 ########################################################################################################################
 
+ENGINES = ('vectorized', 'typed', 'iterrows')
+USED_COLUMNS = ['district_code', 'subjects']
+# fixed string dtypes, a chunk, byte range or file of numeric only district codes or empty subjects is otherwise
+# parsed as numbers and breaks the .str operations
+USED_DTYPES = {'district_code': str, 'subjects': str}
 
-def df_manipulation(input_csv, min_subjects, query_subjects):
+
+def df_manipulation(input_csv, min_subjects, query_subjects, engine='vectorized', chunksize=None, jobs=1,
+                    use_index=False):
     """
     Read dataframe of school subjects offered for certain districts and perform the following operations:
     Drop rows/ schools that offer fewer than <min_subjects> subjects
     remove non alpha-numeric characters from the school_code column
     create data frame with total number of schools offering each <query_subjects> per district
-    :param input_csv: path to csv of school subjects data, str
+    districts are listed in the order they are first seen in the input csv, for several csv files in the order they are
+    first seen when the files are read one after another in the order given by resolve_inputs
+    :param input_csv: path to csv of school subjects data, or a list of paths, a directory of .csv files or a glob, str
     :param min_subjects: min subjects for output df, int
-    :param query_subjects: subjects to tabulate in output df, int
+    :param query_subjects: subjects to tabulate in output df, every subject (see district_subject_matrix) when None, list
+    :param engine: 'vectorized' (default), 'typed' (integer counting over load_school_subjects)
+                   or the original row by row 'iterrows' implementation, str
+    :param chunksize: stream the csv <chunksize> rows at a time so memory tracks the chunk, not the file, int
+    :param jobs: split the csv into line aligned byte ranges aggregated by this many processes,
+                 for several csv files the number of files read concurrently, int
+    :param use_index: answer from the SubjectIndex saved next to the csv, built or rebuilt when needed, bool
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine {engine}, expected one of {ENGINES}")
+    input_files = resolve_inputs(input_csv, '.csv')
+    if len(input_files) > 1:
+        return _multi_file_manipulation(input_files, min_subjects, query_subjects, engine, chunksize, jobs, use_index)
+    input_csv = input_files[0]
+    if query_subjects is None:
+        if chunksize is not None or jobs > 1 or use_index:
+            raise ValueError("chunksize, jobs and use_index are not supported for the all subjects matrix")
+        return district_subject_matrix(input_csv, min_subjects)
+    if use_index:
+        return SubjectIndex.load_or_build(input_csv).query(min_subjects, query_subjects)
+    if engine != 'vectorized' and (chunksize is not None or jobs > 1):
+        raise ValueError("chunksize and jobs are only supported by the vectorized engine")
+    if engine == 'iterrows':
+        return _iterrows_manipulation(pd.read_csv(input_csv, dtype=USED_DTYPES), min_subjects, query_subjects)
+    if engine == 'typed':
+        return _counts_to_df(load_school_subjects(input_csv).counts(min_subjects, query_subjects), query_subjects)
+    if jobs > 1:
+        counts = _parallel_counts(input_csv, min_subjects, query_subjects, chunksize, jobs)
+    else:
+        counts = _stream_counts(input_csv, min_subjects, query_subjects, chunksize)
+    return _counts_to_df(counts, query_subjects)
+
+
+def _file_counts(input_csv, min_subjects, query_subjects, engine, chunksize, use_index):
+    """Process pool worker, pre-aggregate one csv of a multi file input"""
+    if use_index:
+        return SubjectIndex.load_or_build(input_csv).query(min_subjects, query_subjects).set_index('district_code')
+    if engine == 'typed':
+        return load_school_subjects(input_csv).counts(min_subjects, query_subjects)
+    return _stream_counts(input_csv, min_subjects, query_subjects, chunksize)
+
+
+def _multi_file_manipulation(input_files, min_subjects, query_subjects, engine, chunksize, jobs, use_index):
+    """
+    Pre-aggregate every csv, concurrently when jobs > 1, and merge the district tables in file order
+    :param input_files: csv paths in reading order, list
+    """
+    if query_subjects is None:
+        raise ValueError("the all subjects matrix reads a single csv")
+    if engine == 'iterrows':
+        if chunksize is not None or jobs > 1:
+            raise ValueError("chunksize and jobs are only supported by the vectorized engine")
+        raw_df = pd.concat([pd.read_csv(input_file, dtype=USED_DTYPES) for input_file in input_files], ignore_index=True)
+        return _iterrows_manipulation(raw_df, min_subjects, query_subjects)
+    if engine == 'typed' and chunksize is not None:
+        raise ValueError("chunksize is only supported by the vectorized engine")
+
+    total = None
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(input_files))) as executor:
+            futures = [executor.submit(_file_counts, input_file, min_subjects, query_subjects, engine, chunksize,
+                                       use_index) for input_file in input_files]
+            for future in futures:
+                total = _merge_counts(total, future.result())
+    else:
+        for input_file in input_files:
+            total = _merge_counts(total, _file_counts(input_file, min_subjects, query_subjects, engine, chunksize,
+                                                      use_index))
+    return _counts_to_df(total, query_subjects)
+
+
+def _iterrows_manipulation(raw_df, min_subjects, query_subjects):
+    """
+    Original row by row implementation, kept to compare against the vectorized engine
+    :param raw_df: school subjects data, pd.DataFrame
+    :param min_subjects: min subjects for output df, int
+    :param query_subjects: subjects to tabulate in output df, list
     """
-    raw_df = pd.read_csv(input_csv)
     data = {
         'district_code': []
     }
@@ -49,10 +140,596 @@ def df_manipulation(input_csv, min_subjects, query_subjects):
     return output_df
 
 
+def _aggregate_counts(raw_df, min_subjects, query_subjects):
+    """
+    Vectorized aggregation, one pass of pandas string operations followed by a single groupby
+    :param raw_df: school subjects data, pd.DataFrame
+    :param min_subjects: min subjects for output df, int
+    :param query_subjects: subjects to tabulate in output df, list
+    :return counts: schools offering each subject indexed by district in first-seen order, pd.DataFrame
+    """
+    raw_df = raw_df[raw_df['subjects'].notna()]  # a school without subjects never reaches min_subjects
+    # remove non-alphanumeric characters
+    district_codes = raw_df['district_code'].str.replace(r'[^a-zA-Z0-9]', '', regex=True)
+    school_subjects = raw_df['subjects'].str.split(' ')
+    keep = school_subjects.str.len() >= min_subjects
+    district_codes = district_codes[keep]
+    # unique keeps the order the districts are first seen in, same as the row by row implementation
+    districts = district_codes.unique()
+
+    # one row per (school, subject), a school listing the same subject twice still only counts once
+    offered = school_subjects[keep].explode()
+    offered = offered[offered.isin(query_subjects)]
+    pairs = pd.DataFrame({'school': offered.index, 'subject': offered.to_numpy()}).drop_duplicates()
+    pairs = pd.DataFrame({
+        'district_code': pd.Categorical(district_codes.loc[pairs['school']].to_numpy(), categories=districts),
+        'subject': pd.Categorical(pairs['subject'].to_numpy(), categories=query_subjects),
+    })
+    counts = pairs.groupby(['district_code', 'subject'], observed=False).size().unstack()
+    counts = counts.reindex(columns=query_subjects, fill_value=0)  # unstack drops the columns when no school is kept
+    counts.index = pd.Index(districts, dtype=object, name='district_code')
+    counts.columns = pd.Index(query_subjects, dtype=object)
+    return counts
+
+
+def _merge_counts(total, partial):
+    """
+    Add partial district counts to the running total, districts not seen before are appended in their partial order
+    :param total: running counts, pd.DataFrame
+    :param partial: counts for the next block of rows, pd.DataFrame
+    :return total: merged counts, pd.DataFrame
+    """
+    if total is None:
+        return partial
+    new_districts = partial.index.difference(total.index, sort=False)
+    total = total.reindex(total.index.append(new_districts), fill_value=0)
+    total.loc[partial.index] += partial.to_numpy()
+    return total
+
+
+def _counts_to_df(counts, query_subjects):
+    """
+    Build the output frame from the district counts, same layout as the row by row implementation
+    :param counts: schools offering each subject indexed by district, pd.DataFrame
+    :param query_subjects: subjects to tabulate in output df, list
+    """
+    data = {
+        'district_code': list(counts.index)
+    }
+    for sub in query_subjects:
+        data[sub] = counts[sub].tolist()
+    output_df = pd.DataFrame(data)
+
+    return output_df
+
+
+def _stream_counts(source, min_subjects, query_subjects, chunksize=None):
+    """
+    Aggregate the csv chunk by chunk so only one chunk and the district table are held in memory
+    :param source: path to csv of school subjects data or a readable binary buffer, str
+    :param min_subjects: min subjects for output df, int
+    :param query_subjects: subjects to tabulate in output df, list
+    :param chunksize: rows per chunk, the whole csv is read at once when None, int
+    :return counts: schools offering each subject indexed by district in first-seen order, pd.DataFrame
+    """
+    if chunksize is None:
+        return _aggregate_counts(pd.read_csv(source, usecols=USED_COLUMNS, dtype=USED_DTYPES), min_subjects,
+                                 query_subjects)
+    total = None
+    with pd.read_csv(source, usecols=USED_COLUMNS, dtype=USED_DTYPES, chunksize=chunksize) as reader:
+        for chunk in reader:
+            total = _merge_counts(total, _aggregate_counts(chunk, min_subjects, query_subjects))
+    if total is None:  # header only csv
+        total = pd.DataFrame(columns=query_subjects, index=pd.Index([], dtype=object, name='district_code'))
+    return total
+
+
+class _ByteRangeReader(io.RawIOBase):
+    """Read only view of the csv header line followed by the rows in the byte range [start, end)"""
+    def __init__(self, input_csv, header, start, end):
+        super().__init__()
+        self._file = open(input_csv, 'rb')
+        self._file.seek(start)
+        self._header = header
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._header:
+            size = min(len(buffer), len(self._header))
+            buffer[:size] = self._header[:size]
+            self._header = self._header[size:]
+            return size
+        size = self._file.readinto(memoryview(buffer)[:min(len(buffer), self._remaining)])
+        self._remaining -= size
+        return size
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def _byte_ranges(input_csv, parts):
+    """
+    Split the csv rows into roughly equal byte ranges which start and end on line boundaries
+    rows are found by newlines, so quoted fields spanning several lines are not supported
+    :param input_csv: path to csv of school subjects data, str
+    :param parts: number of ranges to split into, int
+    :return header, ranges: header line bytes and list of (start, end) offsets in file order, tuple
+    """
+    size = os.path.getsize(input_csv)
+    with open(input_csv, 'rb') as csv_file:
+        header = csv_file.readline()
+        boundaries = [csv_file.tell()]
+        for part in range(1, parts):
+            offset = max(size * part // parts, boundaries[-1])
+            csv_file.seek(offset)
+            if offset > boundaries[-1]:
+                csv_file.readline()  # move to the start of the next line
+            boundaries.append(csv_file.tell())
+    boundaries.append(size)
+    ranges = [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+    return header, ranges
+
+
+def _range_counts(input_csv, header, start, end, min_subjects, query_subjects, chunksize):
+    """Process pool worker, aggregate the rows of one byte range"""
+    with io.BufferedReader(_ByteRangeReader(input_csv, header, start, end)) as buffer:
+        return _stream_counts(buffer, min_subjects, query_subjects, chunksize)
+
+
+def _parallel_counts(input_csv, min_subjects, query_subjects, chunksize, jobs):
+    """
+    Aggregate line aligned byte ranges of the csv in a process pool and reduce the partial tables in file order,
+    so districts keep the order they are first seen in the file
+    :param input_csv: path to csv of school subjects data, str
+    :param min_subjects: min subjects for output df, int
+    :param query_subjects: subjects to tabulate in output df, list
+    :param chunksize: rows per chunk within each range, int
+    :param jobs: number of worker processes, int
+    :return counts: schools offering each subject indexed by district in first-seen order, pd.DataFrame
+    """
+    header, ranges = _byte_ranges(input_csv, jobs)
+    if not ranges:  # header only csv
+        return _stream_counts(input_csv, min_subjects, query_subjects, chunksize)
+    total = None
+    with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as executor:
+        futures = [executor.submit(_range_counts, input_csv, header, start, end, min_subjects, query_subjects, chunksize)
+                   for start, end in ranges]
+        for future in futures:
+            total = _merge_counts(total, future.result())
+    return total
+
+
+class SchoolSubjects:
+    """Compact typed form of the school subjects csv, see load_school_subjects"""
+    def __init__(self, districts, subject_sets, set_offsets, set_tokens, subjects):
+        """
+        :param districts: normalized district code of each school, categories in first-seen order, pd.Categorical
+        :param subject_sets: id of each school's distinct subjects string, np.ndarray of int32
+        :param set_offsets: set i lists the subject ids set_tokens[set_offsets[i]:set_offsets[i + 1]], np.ndarray
+        :param set_tokens: interned subject ids of every distinct subjects string, np.ndarray of int32
+        :param subjects: subject vocabulary in first-seen order, np.ndarray
+        """
+        self.districts = districts
+        self.subject_sets = subject_sets
+        self.set_offsets = set_offsets
+        self.set_tokens = set_tokens
+        self.subjects = subjects
+
+    @property
+    def subject_counts(self):
+        """number of subjects listed by each school, -1 when the subjects are missing, np.ndarray"""
+        return np.append(np.diff(self.set_offsets), -1)[self.subject_sets]
+
+    def set_membership(self, subject_ids):
+        """
+        :param subject_ids: subject vocabulary positions, -1 for subjects which are not in the vocabulary, list
+        :return membership: distinct subjects string x subject membership, np.ndarray of bool
+        """
+        membership = np.zeros((len(self.set_offsets) - 1, len(subject_ids)), dtype=bool)
+        columns = np.full(len(self.subjects), -1)
+        for column, subject_id in enumerate(subject_ids):
+            if subject_id >= 0:
+                columns[subject_id] = column
+        token_sets = np.repeat(np.arange(len(self.set_offsets) - 1), np.diff(self.set_offsets))
+        token_columns = columns[self.set_tokens]
+        found = token_columns >= 0
+        membership[token_sets[found], token_columns[found]] = True
+        return membership
+
+    def counts(self, min_subjects, query_subjects):
+        """
+        Count schools offering each subject per district on the integer codes
+        :param min_subjects: min subjects for output df, int
+        :param query_subjects: subjects to tabulate in output df, list
+        :return counts: schools offering each subject indexed by district in first-seen order, pd.DataFrame
+        """
+        keep = (self.subject_counts >= min_subjects) & (self.subject_sets >= 0)
+        district_ids = self.districts.codes[keep]
+        sets = self.subject_sets[keep]
+        order = pd.unique(district_ids)  # districts in first-seen order among the kept schools
+        positions = {subject: position for position, subject in enumerate(self.subjects.tolist())}
+        membership = self.set_membership([positions.get(sub, -1) for sub in query_subjects])
+        data = {}
+        for column, sub in enumerate(query_subjects):
+            offered = membership[sets, column]
+            data[sub] = np.bincount(district_ids[offered], minlength=len(self.districts.categories))[order]
+        return pd.DataFrame(data, columns=query_subjects,
+                            index=pd.Index(self.districts.categories[order], dtype=object, name='district_code'))
+
+    def sparse_counts(self, min_subjects):
+        """
+        Count schools offering every subject per district as coordinate triplets, each distinct
+        (district, subjects string) pair is expanded once instead of once per school
+        :param min_subjects: min subjects for a school to be counted, int
+        :return districts, rows, columns, values: district codes in first-seen order and the non-zero counts, tuple
+        """
+        keep = (self.subject_counts >= min_subjects) & (self.subject_sets >= 0)
+        district_ids = self.districts.codes[keep]
+        order = pd.unique(district_ids)  # districts in first-seen order among the kept schools
+        rank = np.zeros(len(self.districts.categories), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        n_sets = len(self.set_offsets) - 1
+        n_subjects = len(self.subjects)
+
+        pair_ids, pairs = pd.factorize(rank[district_ids] * n_sets + self.subject_sets[keep])
+        pair_schools = np.bincount(pair_ids, minlength=len(pairs))
+        pair_rows, pair_sets = np.divmod(np.asarray(pairs, dtype=np.int64), n_sets)
+
+        # distinct subjects of every subjects string, a school listing a subject twice only counts once
+        token_sets = np.repeat(np.arange(n_sets), np.diff(self.set_offsets))
+        set_subjects = np.unique(token_sets * n_subjects + self.set_tokens)
+        distinct_sets, distinct_subjects = np.divmod(set_subjects, n_subjects)
+        distinct_offsets = np.searchsorted(distinct_sets, np.arange(n_sets + 1))
+
+        lengths = np.diff(distinct_offsets)[pair_sets]
+        starts = np.repeat(distinct_offsets[pair_sets] - (np.cumsum(lengths) - lengths), lengths)
+        columns = distinct_subjects[starts + np.arange(lengths.sum())]
+        keys, key_ids = np.unique(np.repeat(pair_rows, lengths) * n_subjects + columns, return_inverse=True)
+        values = np.bincount(key_ids, weights=np.repeat(pair_schools, lengths), minlength=len(keys)).astype(np.int64)
+        rows, columns = np.divmod(keys, n_subjects)
+        return self.districts.categories[order], rows, columns, values
+
+    def memory_usage(self):
+        """total bytes held by the typed columns, int"""
+        return (self.districts.memory_usage(deep=True) + self.subject_sets.nbytes + self.set_offsets.nbytes
+                + self.set_tokens.nbytes + pd.Series(self.subjects).memory_usage(deep=True, index=False))
+
+
+def load_school_subjects(input_csv):
+    """
+    Memory lean loading of the school subjects csv
+    only the district_code and subjects columns are read, both as categoricals, district codes are normalized once
+    per distinct code and each distinct subjects string is split once with its subjects interned to integer ids
+    :param input_csv: path to csv of school subjects data, str
+    :return school_subjects: typed columns, SchoolSubjects
+    """
+    raw_df = pd.read_csv(input_csv, usecols=USED_COLUMNS, dtype={'district_code': 'category', 'subjects': 'category'})
+
+    # remove non-alphanumeric characters from the distinct codes, then number the districts in first-seen order
+    raw_codes = raw_df['district_code'].cat.codes.to_numpy()
+    if (raw_codes < 0).any():  # a code of -1 would be counted for the last district
+        raise ValueError(f"{input_csv} has {(raw_codes < 0).sum()} rows without a district_code, first at row "
+                         f"{int(np.argmax(raw_codes < 0))}")
+    normalized_ids, normalized = pd.factorize(
+        raw_df['district_code'].cat.categories.str.replace(r'[^a-zA-Z0-9]', '', regex=True))
+    district_ids, first_seen = pd.factorize(pd.Series(normalized_ids[raw_codes]).where(raw_codes >= 0))
+    districts = pd.Categorical.from_codes(district_ids, categories=normalized[first_seen.astype(np.int64)])
+
+    # split every distinct subjects string once, in the order they are first seen, missing subjects are set -1
+    raw_codes = raw_df['subjects'].cat.codes.to_numpy()
+    subject_sets, set_codes = pd.factorize(pd.Series(raw_codes).where(raw_codes >= 0))
+    set_subjects = pd.Series(raw_df['subjects'].cat.categories[set_codes.astype(np.int64)]).str.split(' ')
+    set_offsets = np.zeros(len(set_subjects) + 1, dtype=np.int64)
+    np.cumsum(set_subjects.str.len().to_numpy(), out=set_offsets[1:])
+    set_tokens, subjects = pd.factorize(set_subjects.explode())
+    return SchoolSubjects(districts, subject_sets.astype(np.int32), set_offsets, set_tokens.astype(np.int32),
+                          np.asarray(subjects, dtype=str))
+
+
+def district_subject_matrix(input_csv, min_subjects, dense=False, sparse_density=0.5):
+    """
+    Total number of schools offering every subject per district, in one pass over the csv
+    Drop rows/ schools that offer fewer than <min_subjects> subjects
+    districts are listed in the order they are first seen and subjects in the order they first appear in the csv
+    :param input_csv: path to csv of school subjects data, str
+    :param min_subjects: min subjects for output df, int
+    :param dense: always return plain int64 subject columns, bool
+    :param sparse_density: subject columns are stored as pd.SparseDtype when fewer than this fraction of the
+                           counts are non-zero, float
+    :return output_df: district_code column followed by one column per subject, pd.DataFrame
+    """
+    school_subjects = load_school_subjects(input_csv)
+    districts, rows, columns, values = school_subjects.sparse_counts(min_subjects)
+    subjects = school_subjects.subjects.tolist()
+    cells = len(districts) * len(subjects)
+    sparse = not dense and cells and len(values) < sparse_density * cells
+
+    data = {
+        'district_code': list(districts)
+    }
+    by_column = np.argsort(columns, kind='stable')
+    bounds = np.searchsorted(columns[by_column], np.arange(len(subjects) + 1))
+    for position, sub in enumerate(subjects):
+        entries = by_column[bounds[position]:bounds[position + 1]]
+        column = np.zeros(len(districts), dtype=np.int64)
+        column[rows[entries]] = values[entries]
+        data[sub] = pd.arrays.SparseArray(column, fill_value=0) if sparse else column
+    output_df = pd.DataFrame(data)
+
+    return output_df
+
+
+def _file_sha256(path):
+    """
+    :param path: file to hash, str
+    :return digest: hex sha256 of the file contents, str
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as in_file:
+        for block in iter(lambda: in_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SubjectIndex:
+    """Persistent school x subject membership index, answers df_manipulation queries without re-parsing the csv"""
+    VERSION = 1
+
+    def __init__(self, districts, district_ids, subject_counts, subjects, membership, source):
+        """
+        :param districts: normalized district codes in first-seen order, np.ndarray
+        :param district_ids: position in <districts> of each school's district, np.ndarray
+        :param subject_counts: number of subjects listed by each school, np.ndarray
+        :param subjects: subject vocabulary in first-seen order, np.ndarray
+        :param membership: school x subject membership bitsets packed with np.packbits, np.ndarray
+        :param source: mtime_ns, size and sha256 of the csv the index was built from, dict
+        """
+        self.districts = districts
+        self.district_ids = district_ids
+        self.subject_counts = subject_counts
+        self.subjects = subjects
+        self.membership = membership
+        self.source = source
+        self._subject_positions = {subject: position for position, subject in enumerate(subjects.tolist())}
+
+    @staticmethod
+    def default_path(input_csv):
+        return f'{input_csv}.idx.npz'
+
+    @classmethod
+    def build(cls, input_csv):
+        """
+        Parse the csv once and build the index
+        :param input_csv: path to csv of school subjects data, str
+        """
+        stat = os.stat(input_csv)
+        source = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': _file_sha256(input_csv)}
+        school_subjects = load_school_subjects(input_csv)
+        # pack the bits once per distinct subjects string, the extra zero row is for schools with missing subjects
+        set_bits = np.packbits(school_subjects.set_membership(range(len(school_subjects.subjects))), axis=1)
+        set_bits = np.vstack([set_bits, np.zeros((1, set_bits.shape[1]), dtype=np.uint8)])
+        return cls(np.asarray(school_subjects.districts.categories, dtype=str),
+                   school_subjects.districts.codes.astype(np.int32), school_subjects.subject_counts.astype(np.int32),
+                   school_subjects.subjects, set_bits[school_subjects.subject_sets], source)
+
+    def save(self, index_path):
+        """
+        Write the index, the file is replaced atomically so a reader never sees a partial index
+        :param index_path: path to the .npz index file, str
+        """
+        tmp_path = f'{index_path}.tmp'
+        with open(tmp_path, 'wb') as out_file:
+            np.savez(out_file, version=self.VERSION, districts=self.districts, district_ids=self.district_ids,
+                     subject_counts=self.subject_counts, subjects=self.subjects, membership=self.membership,
+                     mtime_ns=self.source['mtime_ns'], size=self.source['size'], sha256=self.source['sha256'])
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def load(cls, index_path):
+        """
+        :param index_path: path to the .npz index file, str
+        """
+        with np.load(index_path, allow_pickle=False) as saved:
+            if int(saved['version']) != cls.VERSION:
+                raise ValueError(f"unsupported index version {int(saved['version'])} in {index_path}")
+            source = {'mtime_ns': int(saved['mtime_ns']), 'size': int(saved['size']), 'sha256': str(saved['sha256'])}
+            return cls(saved['districts'], saved['district_ids'], saved['subject_counts'], saved['subjects'],
+                       saved['membership'], source)
+
+    @classmethod
+    def load_or_build(cls, input_csv, index_path=None, verify_hash=False):
+        """
+        Load the saved index, rebuilding it when the csv has changed since it was built.
+        A changed mtime or size triggers a hash comparison, so touching the csv does not force a rebuild
+        :param input_csv: path to csv of school subjects data, str
+        :param index_path: path to the .npz index file, defaults to <input_csv>.idx.npz, str
+        :param verify_hash: also compare the sha256 when mtime and size are unchanged, bool
+        """
+        index_path = cls.default_path(input_csv) if index_path is None else index_path
+        if os.path.exists(index_path):
+            try:
+                index = cls.load(index_path)
+            except Exception as e:
+                logger.warning(f"Discarding unreadable index {index_path}: {e}")
+            else:
+                stat = os.stat(input_csv)
+                if index.source['mtime_ns'] == stat.st_mtime_ns and index.source['size'] == stat.st_size \
+                        and not verify_hash:
+                    return index
+                if index.source['sha256'] == _file_sha256(input_csv):
+                    index.source.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                    index.save(index_path)
+                    return index
+        logger.info(f'Building subject index {index_path} for {input_csv}')
+        index = cls.build(input_csv)
+        index.save(index_path)
+        return index
+
+    def _subject_column(self, subject):
+        """
+        :param subject: subject to look up, str
+        :return offered: membership of every school for the subject, np.ndarray of bool
+        """
+        position = self._subject_positions[subject]
+        return (self.membership[:, position // 8] >> (7 - position % 8)) & 1 == 1
+
+    def query(self, min_subjects, query_subjects):
+        """
+        Same output as df_manipulation
+        :param min_subjects: min subjects for output df, int
+        :param query_subjects: subjects to tabulate in output df, list
+        """
+        keep = self.subject_counts >= min_subjects
+        kept_ids = self.district_ids[keep]
+        order = pd.unique(kept_ids)  # districts in first-seen order among the kept schools
+        data = {
+            'district_code': self.districts[order].tolist()
+        }
+        for sub in query_subjects:
+            if sub in self._subject_positions:
+                offered = self._subject_column(sub)[keep]
+                data[sub] = np.bincount(kept_ids[offered], minlength=len(self.districts))[order].tolist()
+            else:
+                data[sub] = [0] * len(order)
+        output_df = pd.DataFrame(data)
+
+        return output_df
+
+
+class IncrementalAggregator:
+    """
+    Running df_manipulation counts for a csv which only grows by appended rows
+    a last row without a trailing newline may still be being written, so it is only counted once an update finds
+    the file size unchanged since the previous update, until then the result leaves that row out
+    """
+    def __init__(self, input_csv, min_subjects, query_subjects, state_path=None, chunksize=None):
+        """
+        Load the saved counts and file offset, starting from scratch when there is no state for these arguments
+        :param input_csv: path to csv of school subjects data, rows must be appended whole, str
+        :param min_subjects: min subjects for output df, int
+        :param query_subjects: subjects to tabulate in output df, list
+        :param state_path: json file holding the running counts, defaults to <input_csv>.state.json, str
+        :param chunksize: rows per chunk when reading new rows, int
+        """
+        self.input_csv = input_csv
+        self.min_subjects = min_subjects
+        self.query_subjects = list(query_subjects)
+        self.state_path = f'{input_csv}.state.json' if state_path is None else state_path
+        self.chunksize = chunksize
+        self.reset()
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+            if state['min_subjects'] == self.min_subjects and state['query_subjects'] == self.query_subjects:
+                self.header = state['header'].encode()
+                self.offset = state['offset']
+                self.size = state.get('size')
+                self.counts = pd.DataFrame(
+                    np.array(state['counts'], dtype=np.int64).reshape(len(state['districts']), len(self.query_subjects)),
+                    index=pd.Index(state['districts'], dtype=object, name='district_code'), columns=self.query_subjects)
+            else:
+                logger.info(f'Ignoring {self.state_path}, it was saved for different arguments')
+
+    def reset(self):
+        """forget the processed rows, the next update reads the whole csv"""
+        self.header = None
+        self.offset = 0
+        self.size = None  # file size at the last update
+        self.counts = pd.DataFrame(columns=self.query_subjects, dtype=np.int64,
+                                   index=pd.Index([], dtype=object, name='district_code'))
+
+    def update(self):
+        """
+        Aggregate the rows appended since the last update and save the new state,
+        the csv is re-read from the start when it was truncated or its header changed
+        :return output_df: same output as df_manipulation for the whole csv, pd.DataFrame
+        """
+        with open(self.input_csv, 'rb') as csv_file:
+            header = csv_file.readline()
+            size = os.fstat(csv_file.fileno()).st_size
+            if header != self.header or size < self.offset:
+                if self.header is not None:
+                    logger.info(f'{self.input_csv} was rewritten, recounting from the start')
+                self.reset()
+                self.header = header
+                self.offset = len(header)
+            end = _last_line_end(csv_file, self.offset, size)
+        if end < size and size == self.size:  # the unterminated last row did not grow since the last update
+            end = size
+        self.size = size
+        if end > self.offset:
+            with io.BufferedReader(_ByteRangeReader(self.input_csv, self.header, self.offset, end)) as buffer:
+                partial = _stream_counts(buffer, self.min_subjects, self.query_subjects, self.chunksize)
+            self.counts = _merge_counts(self.counts, partial).astype(np.int64)
+            self.offset = end
+        self.save()
+        return _counts_to_df(self.counts, self.query_subjects)
+
+    def save(self):
+        """write the state, the file is replaced atomically so a crash never leaves a partial state"""
+        state = {
+            'min_subjects': self.min_subjects,
+            'query_subjects': self.query_subjects,
+            'header': self.header.decode(),
+            'offset': self.offset,
+            'size': self.size,
+            'districts': list(self.counts.index),
+            'counts': self.counts.to_numpy().tolist(),
+        }
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_path, self.state_path)
+
+
+def _last_line_end(csv_file, start, end, block_size=1 << 16):
+    """
+    Offset just past the last newline in [start, end), a trailing row still being written is left for later
+    :param csv_file: csv opened in binary mode, file
+    :param start: first offset to search, int
+    :param end: file size, int
+    :return offset: end of the last complete line, start when there is none, int
+    """
+    position = end
+    while position > start:
+        block_start = max(start, position - block_size)
+        csv_file.seek(block_start)
+        newline = csv_file.read(position - block_start).rfind(b'\n')
+        if newline >= 0:
+            return block_start + newline + 1
+        position = block_start
+    return start
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Pandas Dataframe Manipulation")
-    parser.add_argument('-i', '--input_csv', type=str, action="store", required=True, help="csv input dataframe")
+    parser.add_argument('-i', '--input_csv', type=str, action="append", required=True, help="csv input dataframe, directory of csv files or glob, repeatable")
     parser.add_argument('-m', '--min_subjects', type=int, action="store", required=True, help="minimum school subjects offered")
-    parser.add_argument('-s', '--query_subjects', type=str, action="append", required=True, help="subjects to counts for output df")
+    parser.add_argument('-s', '--query_subjects', type=str, action="append", default=None, help="subjects to counts for output df, every subject when omitted")
+    parser.add_argument('-e', '--engine', type=str, action="store", default='vectorized', choices=ENGINES, help="aggregation engine")
+    parser.add_argument('-c', '--chunksize', type=int, action="store", default=None, help="stream the csv this many rows at a time")
+    parser.add_argument('-j', '--jobs', type=int, action="store", default=1, help="worker processes for the aggregation")
+    parser.add_argument('-x', '--use_index', action="store_true", help="answer from the subject index saved next to the csv")
+    parser.add_argument('-d', '--dense', action="store_true", help="dense subject columns for the all subjects matrix")
+    parser.add_argument('-u', '--state', type=str, action="store", default=None, help="json state file, only rows appended since the last run are read")
     parser_args = parser.parse_args()
-    result = df_manipulation(parser_args.input_csv, parser_args.min_subjects, parser_args.query_subjects)
\ No newline at end of file
+    if (parser_args.query_subjects is None or parser_args.state is not None) and len(parser_args.input_csv) > 1:
+        parser.error("the all subjects matrix and --state read a single csv")
+    if parser_args.query_subjects is None and (parser_args.chunksize is not None or parser_args.jobs > 1
+                                              or parser_args.engine != 'vectorized' or parser_args.use_index):
+        parser.error("-c, -j, -e and -x are not supported for the all subjects matrix (-s omitted)")
+    if parser_args.state is not None and (parser_args.jobs > 1 or parser_args.engine != 'vectorized'
+                                          or parser_args.use_index):
+        parser.error("-j, -e and -x are not supported with --state, the appended rows are read by the vectorized engine")
+    if parser_args.query_subjects is None:
+        result = district_subject_matrix(parser_args.input_csv[0], parser_args.min_subjects, parser_args.dense)
+    elif parser_args.state is not None:
+        result = IncrementalAggregator(parser_args.input_csv[0], parser_args.min_subjects, parser_args.query_subjects,
+                                       parser_args.state, parser_args.chunksize).update()
+    else:
+        result = df_manipulation(parser_args.input_csv, parser_args.min_subjects, parser_args.query_subjects,
+                                 parser_args.engine, parser_args.chunksize, parser_args.jobs, parser_args.use_index)
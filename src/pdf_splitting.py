@@ -1,7 +1,13 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pypdf import PdfReader, PdfWriter
-from src.shared import logger
+from src.shared import logger, resolve_inputs
+import hashlib
+import io
+import json
 import re
 import os
+import sqlite3
+import time
 
 ########################################################################################################################
 # Pdf Splitting Module
@@ -10,15 +16,220 @@ import os
 ########################################################################################################################
 
 
+class PageTextCache:
+    """Persistent cache of extracted page texts, keyed by the pdf content hash and the page index"""
+
+    def __init__(self, db_path: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Open or create the cache
+        Args:
+            db_path: sqlite database file
+            max_bytes: cap on the cached text size, least recently used pages are evicted past it
+        """
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(db_path, timeout=30)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS page_texts (pdf_hash TEXT, page_index INTEGER, text TEXT, "
+                "size INTEGER, last_used REAL, PRIMARY KEY (pdf_hash, page_index))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS page_texts_last_used ON page_texts (last_used)")
+
+    @staticmethod
+    def pdf_hash(source: PdfReader) -> str:
+        """
+        Hash the pdf contents so renamed or copied files share their cached pages
+        Args:
+            source: input pdf
+        Returns: hex sha256 of the pdf bytes
+        """
+        digest = hashlib.sha256()
+        position = source.stream.tell()
+        source.stream.seek(0)
+        for block in iter(lambda: source.stream.read(1 << 20), b''):
+            digest.update(block)
+        source.stream.seek(position)
+        return digest.hexdigest()
+
+    def get_many(self, pdf_hash: str, page_indices: list[int]) -> dict[int, str]:
+        """
+        Look up cached page texts and mark them as recently used
+        Args:
+            pdf_hash: pdf content hash
+            page_indices: pages to look up
+        Returns: cached texts by page index, pages which are not cached are left out
+        """
+        texts = {}
+        for start in range(0, len(page_indices), 500):  # stay below the sqlite variable limit
+            batch = page_indices[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT page_index, text FROM page_texts WHERE pdf_hash = ? AND page_index IN "
+                f"({', '.join('?' * len(batch))})", [pdf_hash, *batch])
+            texts.update(rows)
+        with self.connection:
+            self.connection.executemany("UPDATE page_texts SET last_used = ? WHERE pdf_hash = ? AND page_index = ?",
+                                        [(time.time(), pdf_hash, index) for index in texts])
+        return texts
+
+    def put_many(self, pdf_hash: str, page_texts: dict[int, str]):
+        """
+        Store page texts, then evict the least recently used pages while the cache is over its size cap
+        Args:
+            pdf_hash: pdf content hash
+            page_texts: extracted texts by page index
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO page_texts VALUES (?, ?, ?, ?, ?)",
+                [(pdf_hash, index, text, len(text.encode()), time.time()) for index, text in page_texts.items()])
+            excess = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM page_texts").fetchone()[0] \
+                - self.max_bytes
+            evicted = []
+            if excess > 0:
+                for evict_hash, evict_index, size in self.connection.execute(
+                        "SELECT pdf_hash, page_index, size FROM page_texts ORDER BY last_used"):
+                    evicted.append((evict_hash, evict_index))
+                    excess -= size
+                    if excess <= 0:
+                        break
+            self.connection.executemany("DELETE FROM page_texts WHERE pdf_hash = ? AND page_index = ?", evicted)
+
+    def close(self):
+        self.connection.close()
+
+
+def _contiguous_shards(items: list, jobs: int) -> list[list]:
+    """Split items into at most <jobs> contiguous runs of near equal size"""
+    shard_size = -(-len(items) // max(1, jobs))
+    return [items[start:start + shard_size] for start in range(0, len(items), shard_size)]
+
+
+def _extract_page_range(path_to_pdf: str, page_indices: list[int]) -> list[str]:
+    """Worker: open a private reader and extract the texts of a run of pages"""
+    reader = PdfReader(path_to_pdf, strict=False)
+    return [reader.pages[index].extract_text() for index in page_indices]
+
+
+def _output_name(path_to_pdf: str, out_folder: str, index: int) -> str:
+    """Output path of the <index>th written file"""
+    filename = os.path.split(path_to_pdf)[1]
+    return f'{out_folder}/{filename}'.replace(".pdf", f"_{index}.pdf")  # use index for page name
+
+
+def _iter_write_groups(reader: PdfReader, path_to_pdf: str, out_folder: str,
+                       groups: list[tuple[int, list[int]]], optimize: bool = False):
+    """
+    Write each (output index, page numbers) group with a single writer, yielding (output index, path) as soon as a
+    file is written, or (output index, BytesIO) without touching the filesystem when out_folder is None, followed by
+    the pages, bytes and seconds of the write
+    """
+    for index, nums in groups:
+        start = time.perf_counter()
+        writer = PdfWriter()
+        for num in nums:
+            writer.add_page(reader.pages[num])  # use number to get the correct page num
+        if optimize:
+            for page in writer.pages:
+                page.compress_content_streams()
+            writer.compress_identical_objects()  # fonts and images shared by the pages are written once
+        if out_folder is None:
+            output = io.BytesIO()
+            writer.write(output)
+            output.seek(0)
+            size = output.getbuffer().nbytes
+        else:
+            output = _output_name(path_to_pdf, out_folder, index)
+            writer.write(output)
+            size = os.path.getsize(output)
+        writer.close()
+        yield index, output, len(nums), size, time.perf_counter() - start
+
+
+def _write_pages(path_to_pdf: str, out_folder: str, groups: list[tuple[int, list[int]]],
+                 optimize: bool = False) -> list[tuple]:
+    """Worker: open a private reader and write a run of page groups"""
+    return list(_iter_write_groups(PdfReader(path_to_pdf, strict=False), path_to_pdf, out_folder, groups, optimize))
+
+
+def _finished_inputs(manifest_path: str) -> set[str]:
+    """Inputs recorded as done in a json lines manifest, a line cut short by a crash is ignored"""
+    finished = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest:
+            for line in manifest:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get('status') == 'done':
+                    finished.add(record['input'])
+    return finished
+
+
+def _split_one(splitter: "PdfSplitting", path_to_pdf: str, out_folder: str, split_options: dict) -> dict:
+    """Worker: split one pdf of a batch into its own folder, failures are recorded instead of raised"""
+    start = time.perf_counter()
+    record = {'input': path_to_pdf, 'out_folder': out_folder, 'size_bytes': os.path.getsize(path_to_pdf)}
+    try:
+        os.makedirs(out_folder, exist_ok=True)
+        record.update(status='done', outputs=splitter.split_pdf(path_to_pdf, out_folder, **split_options), error=None,
+                      bytes_written=splitter.stats['bytes_written'])
+    except Exception as e:
+        record.update(status='failed', outputs=[], error=f"{type(e).__name__}: {e}")
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+
 class PdfSplitting:
     """Split pdfs into separate pages"""
 
+    def __init__(self):
+        self.stats = {}  # output totals of the last split, see iter_split_pdf
+
+    @staticmethod
+    def extract_page_texts(
+            source: PdfReader,
+            page_indices: list[int],
+            text_cache: PageTextCache = None,
+            jobs: int = 1,
+            source_path: str = None,
+    ) -> dict[int, str]:
+        """
+        Extract the text of pages, skipping the extraction of pages found in the cache
+        Args:
+            source: input pdf
+            page_indices: indices of the pages to extract
+            text_cache: optional cache of previously extracted page texts
+            jobs: worker processes, each opens its own reader of <source_path> and extracts a contiguous page run
+            source_path: path of the input pdf, required for jobs > 1
+        Returns: page texts by page index
+        """
+        page_texts = {}
+        if text_cache is not None:
+            pdf_hash = text_cache.pdf_hash(source)
+            page_texts = text_cache.get_many(pdf_hash, page_indices)
+        missing = sorted({index for index in page_indices if index not in page_texts})
+        if jobs > 1 and source_path is not None and len(missing) > 1:
+            shards = _contiguous_shards(missing, jobs)
+            with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+                shard_texts = executor.map(_extract_page_range, [source_path] * len(shards), shards)
+                extracted = {index: text for shard, texts in zip(shards, shard_texts)
+                             for index, text in zip(shard, texts)}
+        else:
+            extracted = {index: source.pages[index].extract_text() for index in missing}
+        if text_cache is not None and extracted:
+            text_cache.put_many(pdf_hash, extracted)
+        page_texts.update(extracted)
+        return page_texts
+
     @staticmethod
     def filter_pages(
             source: PdfReader,
             page_indices: list[int] = None,
             includes: list[str] = [],
             excludes: list[str] = [],
+            text_cache: PageTextCache = None,
+            jobs: int = 1,
+            source_path: str = None,
     ) -> list[int]:
         """
         Filter pdf by page number and/or text
@@ -27,13 +238,17 @@ class PdfSplitting:
             page_indices: indices of the pdf to include
             includes: required page texts for inclusion
             excludes: exclude pages with these texts
+            text_cache: optional cache of previously extracted page texts
+            jobs: worker processes for text extraction
+            source_path: path of the input pdf, required for jobs > 1
         Returns: page indices to write to output
         """
         page_indices = [x for x in range(source.get_num_pages())] if page_indices is None else page_indices
         if len(includes) or len(excludes):
             remove_indices = set()
+            page_texts = PdfSplitting.extract_page_texts(source, page_indices, text_cache, jobs, source_path)
             for index in page_indices:
-                page_text = source.pages[index].extract_text()
+                page_text = page_texts[index]
                 for exclusion_regex in excludes:
                     exclusion_regex = exclusion_regex.replace(" ", "\\s*")
                     if re.compile(exclusion_regex).search(
@@ -53,33 +268,187 @@ class PdfSplitting:
             page_indices = [idx for idx in page_indices if idx not in remove_indices]
         return page_indices
 
+    @staticmethod
+    def group_pages(
+            page_nums: list[int],
+            page_ranges: list[tuple[int, int]] = None,
+            pages_per_file: int = None,
+    ) -> list[list[int]]:
+        """
+        Group the selected pages into output files
+        Args:
+            page_nums: selected page numbers in output order
+            page_ranges: inclusive (first, last) page ranges, one output file per range
+            pages_per_file: at most this many pages per output file, ranges longer than this are split as well
+        Returns: page numbers of each output file, a single page per file when neither option is given
+        """
+        if page_ranges is not None:
+            selected = set(page_nums)
+            groups = [[num for num in range(first, last + 1) if num in selected] for first, last in page_ranges]
+            groups = [group for group in groups if len(group)]  # ranges where every page was filtered out
+        elif pages_per_file is not None:
+            groups = [page_nums]
+        else:
+            groups = [[num] for num in page_nums]
+        if pages_per_file is not None:
+            if pages_per_file < 1:
+                raise ValueError(f"pages_per_file must be at least 1, got {pages_per_file}")
+            groups = [group[start:start + pages_per_file] for group in groups
+                      for start in range(0, len(group), pages_per_file)]
+        return groups
+
+    def iter_split_pdf(self,
+                       path_to_pdf: str,
+                       out_folder: str = None,
+                       page_indices: list[int] = None,
+                       includes: list[str] = [],
+                       excludes: list[str] = [],
+                       text_cache: PageTextCache = None,
+                       jobs: int = 1,
+                       page_ranges: list[tuple[int, int]] = None,
+                       pages_per_file: int = None,
+                       optimize: bool = False,
+                       ):
+        """
+        Split pdf like split_pdf, yielding each output as soon as it is written
+        Args:
+            path_to_pdf: input pdf
+            out_folder: output folder, None keeps the outputs in memory
+            page_indices: indices of the pdf to include
+            includes: required page texts for inclusion
+            excludes: exclude pages with these texts
+            text_cache: optional cache of previously extracted page texts
+            jobs: worker processes for text extraction and writing, outputs are yielded one worker run at a time
+            page_ranges: inclusive (first, last) page ranges written to one file each, replaces page_indices
+            pages_per_file: at most this many pages per output file
+            optimize: compress the page content streams and write identical objects once per output,
+                smaller files for more cpu time
+        Returns: generator of (output index, path), or (output index, BytesIO) when out_folder is None,
+            in output order. self.stats holds the files, pages, bytes written and write seconds (per page) so far
+        """
+        self.stats = {'files': 0, 'pages': 0, 'bytes_written': 0, 'write_seconds': 0.0, 'seconds_per_page': 0.0,
+                      'optimize': optimize}
+        reader = PdfReader(path_to_pdf, strict=False)
+        if page_ranges is not None:
+            invalid = [(first, last) for first, last in page_ranges if first > last]
+            if invalid:
+                raise ValueError(f"page ranges {invalid} end before they start")
+            page_indices = [num for first, last in page_ranges for num in range(first, last + 1)]
+        num_pages = reader.get_num_pages()
+        out_of_range = [] if page_indices is None else [num for num in page_indices if not 0 <= num < num_pages]
+        if out_of_range:
+            raise ValueError(f"pages {out_of_range} are outside the {num_pages} pages of {path_to_pdf}")
+        # the extra options are only passed when used, so subclasses overriding the original
+        # filter_pages(source, page_indices, includes, excludes) keep working
+        filter_options = {}
+        if text_cache is not None:
+            filter_options['text_cache'] = text_cache
+        if jobs > 1:
+            filter_options.update(jobs=jobs, source_path=path_to_pdf)
+        page_nums = self.filter_pages(reader, page_indices, includes, excludes, **filter_options)
+        groups = list(enumerate(self.group_pages(page_nums, page_ranges, pages_per_file)))
+        if jobs > 1 and len(groups) > 1:
+            # each worker re-opens the source and writes a contiguous run of the output files
+            shards = _contiguous_shards(groups, jobs)
+            with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+                writes = (write for shard_writes in executor.map(
+                    _write_pages, [path_to_pdf] * len(shards), [out_folder] * len(shards), shards,
+                    [optimize] * len(shards)) for write in shard_writes)
+                yield from self._record_writes(writes)
+        else:
+            yield from self._record_writes(_iter_write_groups(reader, path_to_pdf, out_folder, groups, optimize))
+        logger.info(f"Wrote {self.stats['files']} files, {self.stats['pages']} pages, "
+                    f"{self.stats['bytes_written']:,} bytes from {path_to_pdf} in {self.stats['write_seconds']:.3f}s "
+                    f"({self.stats['seconds_per_page'] * 1000:.2f} ms per page, optimize={optimize})")
+
+    def _record_writes(self, writes):
+        """Add each write to self.stats and pass on its (output index, output)"""
+        for index, output, pages, size, seconds in writes:
+            self.stats['files'] += 1
+            self.stats['pages'] += pages
+            self.stats['bytes_written'] += size
+            self.stats['write_seconds'] += seconds
+            self.stats['seconds_per_page'] = self.stats['write_seconds'] / self.stats['pages']
+            yield index, output
+
     def split_pdf(self,
                   path_to_pdf: str,
                   out_folder: str,
                   page_indices: list[int] = None,
                   includes: list[str] = [],
                   excludes: list[str] = [],
+                  text_cache: PageTextCache = None,
+                  jobs: int = 1,
+                  page_ranges: list[tuple[int, int]] = None,
+                  pages_per_file: int = None,
+                  optimize: bool = False,
                   ):
         """
-        Split pdf and optionally filter pages and/or text
+        Split pdf and optionally filter pages and/or text, with jobs > 1 the text extraction and the page writes are
+        spread across worker processes. page_ranges (inclusive, replacing page_indices) and/or pages_per_file write
+        several pages per output file, see group_pages. optimize trades cpu for smaller outputs, self.stats reports
+        the bytes written and seconds per page
         """
         try:
-            reader = PdfReader(path_to_pdf, strict=False)
-            output_names = []
-            page_nums = self.filter_pages(reader, page_indices, includes, excludes)
-            filename = os.path.split(path_to_pdf)[1]
-            for index, num in enumerate(page_nums):
-                output_name = f'{out_folder}/{filename}'.replace(".pdf", f"_{index}.pdf") # use index for page name
-                writer = PdfWriter()
-                writer.add_page(reader.pages[num]) # use number to get the correct page num
-                writer.write(output_name)
-                writer.close()
-                output_names.append(output_name)
-            return output_names
+            return [output_name for _, output_name in self.iter_split_pdf(
+                path_to_pdf, out_folder, page_indices, includes, excludes, text_cache, jobs, page_ranges,
+                pages_per_file, optimize)]
         except Exception as e:
             logger.error(f"An error occurred writing splitting {path_to_pdf}: {e}")
             raise
 
+    def split_batch(self,
+                    inputs,
+                    out_folder: str,
+                    manifest_path: str = None,
+                    jobs: int = 1,
+                    **split_options,
+                    ) -> list[dict]:
+        """
+        Split many pdfs in one process pool, largest files first, each into <out_folder>/<pdf path>/ where the pdf
+        path is relative to the folder shared by all inputs, <out_folder>/<pdf name>/ for the pdfs of one folder
+        Args:
+            inputs: pdf path, list of paths, directory of .pdf files or glob
+            out_folder: root output folder
+            manifest_path: json lines manifest, one record per finished input with its outputs, status and timings,
+                inputs already recorded as done are skipped so a crashed batch resumes where it stopped,
+                defaults to <out_folder>/manifest.jsonl
+            jobs: number of pdfs split concurrently
+            split_options: keyword arguments of split_pdf for every input (a text_cache can not be shared by workers)
+        Returns: manifest records of the inputs split by this call, in completion order
+        """
+        manifest_path = manifest_path or os.path.join(out_folder, 'manifest.jsonl')
+        finished = _finished_inputs(manifest_path)
+        input_files = list(dict.fromkeys(os.path.abspath(path) for path in resolve_inputs(inputs, '.pdf')))
+        # output folders mirror the input paths below their common folder, so pdfs sharing a name do not collide
+        common_root = os.path.commonpath([os.path.dirname(path) for path in input_files]) if input_files else ''
+        pending = sorted((path for path in input_files if path not in finished), key=os.path.getsize, reverse=True)
+        logger.info(f"Splitting {len(pending)} pdfs, skipping {len(input_files) - len(pending)} already done")
+        out_folders = [os.path.join(out_folder, os.path.splitext(os.path.relpath(path, common_root))[0])
+                       for path in pending]
+        os.makedirs(out_folder, exist_ok=True)
+        records = []
+        with open(manifest_path, 'a') as manifest:
+            def add_record(record):
+                manifest.write(json.dumps(record) + '\n')
+                manifest.flush()  # a crash loses at most the inputs still being split
+                records.append(record)
+                if record['status'] != 'done':
+                    logger.error(f"Failed to split {record['input']}: {record['error']}")
+
+            if jobs > 1 and len(pending) > 1:
+                with ProcessPoolExecutor(max_workers=jobs) as executor:  # tasks start in submission order
+                    futures = [executor.submit(_split_one, self, path, folder, split_options)
+                               for path, folder in zip(pending, out_folders)]
+                    for future in as_completed(futures):
+                        add_record(future.result())
+            else:
+                for path, folder in zip(pending, out_folders):
+                    add_record(_split_one(self, path, folder, split_options))
+        logger.info(f"Split {sum(record['status'] == 'done' for record in records)} of {len(pending)} pdfs, "
+                    f"manifest {manifest_path}")
+        return records
+
 class CustomPDFSplitter(PdfSplitting):
     """method to over-ride filter pages method for a different includes logic"""
     @staticmethod
@@ -88,6 +457,9 @@ class CustomPDFSplitter(PdfSplitting):
         page_indices: list[int] = None,
         includes: list[str] = [],
         excludes: list[str] = [],
+        text_cache: PageTextCache = None,
+        jobs: int = 1,
+        source_path: str = None,
     ) -> list[int]:
         """
         over-riding the filter_pages method to include pdfs matching any of the includes regex patterns
@@ -95,8 +467,9 @@ class CustomPDFSplitter(PdfSplitting):
         page_indices = [x for x in range(source.get_num_pages())] if page_indices is None else page_indices
         if len(includes) or len(excludes):
             remove_indices = set()
+            page_texts = PdfSplitting.extract_page_texts(source, page_indices, text_cache, jobs, source_path)
             for index in page_indices:
-                page_text = source.pages[index].extract_text()
+                page_text = page_texts[index]
                 for exclusion_regex in excludes:
                     exclusion_regex = exclusion_regex.replace(" ", "\\s*")
                     if re.compile(exclusion_regex).search(page_text) is not None: # only including if exclude text is not found
@@ -113,15 +486,50 @@ class CustomPDFSplitter(PdfSplitting):
             page_indices = [idx for idx in page_indices if idx not in remove_indices]
         return page_indices
 
+def _parse_page_range(page_range: str) -> tuple[int, int]:
+    """'first-last' (or a single page number) to an inclusive (first, last) range"""
+    first, _, last = page_range.partition('-')
+    return int(first), int(last or first)
+
+
+def _is_batch_input(input_pdf: str) -> bool:
+    """a directory or glob of pdfs is split as a batch"""
+    return os.path.isdir(input_pdf) or (not os.path.exists(input_pdf) and re.search(r'[*?\[]', input_pdf) is not None)
+
+
 def main(args):
     # input_pdf = "./Input/Python.pdf"
-    PdfSplitting().split_pdf(args.input_pdf, args.out_folder, [0, 1, 2])
+    page_ranges = [_parse_page_range(page_range) for page_range in args.page_ranges] if args.page_ranges else None
+    split_options = dict(page_indices=args.pages, includes=args.includes or [], excludes=args.excludes or [],
+                         page_ranges=page_ranges, pages_per_file=args.pages_per_file, optimize=args.optimize)
+    if _is_batch_input(args.input_pdf):
+        PdfSplitting().split_batch(args.input_pdf, args.out_folder, args.manifest, args.jobs, **split_options)
+        return
+    text_cache = PageTextCache(args.text_cache, args.cache_mb * 1024 * 1024) if args.text_cache else None
+    try:
+        PdfSplitting().split_pdf(args.input_pdf, args.out_folder, text_cache=text_cache, jobs=args.jobs,
+                                 **split_options)
+    finally:
+        if text_cache is not None:
+            text_cache.close()
 
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="PDF Splitting Module")
-    parser.add_argument('-i', '--input_pdf', type=str, action="store", required=True, help="full path to input file")
+    parser.add_argument('-i', '--input_pdf', type=str, action="store", required=True, help="full path to input file, or a directory/glob of pdfs to split as a batch")
     parser.add_argument('-o', '--out_folder', type=str, action="store", required=True, help="output folder")
+    parser.add_argument('-n', '--includes', type=str, action="append", help="required page text regex, repeatable")
+    parser.add_argument('-x', '--excludes', type=str, action="append", help="exclude pages with this text regex, repeatable")
+    parser.add_argument('-c', '--text_cache', type=str, action="store", default=None, help="sqlite page text cache file")
+    parser.add_argument('-m', '--cache_mb', type=int, action="store", default=256, help="page text cache size cap in MB")
+    parser.add_argument('-j', '--jobs', type=int, action="store", default=1, help="worker processes")
+    parser.add_argument('-r', '--page_ranges', type=str, action="append", help="first-last page range per output file, repeatable")
+    parser.add_argument('-g', '--pages_per_file', type=int, action="store", default=None, help="pages per output file")
+    parser.add_argument('-b', '--manifest', type=str, action="store", default=None, help="batch manifest, json lines")
+    parser.add_argument('-z', '--optimize', action="store_true", help="compress content streams, dedupe identical objects")
+    parser.add_argument('-s', '--pages', type=int, nargs='+', default=None, help="0 based pages to split, every page when omitted")
     parser_args = parser.parse_args()
+    if parser_args.text_cache and _is_batch_input(parser_args.input_pdf):
+        parser.error("-c is not supported for a batch, its workers can not share one page text cache")
     main(parser_args)
\ No newline at end of file
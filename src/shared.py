@@ -1,4 +1,7 @@
+import glob
 import logging
+import os
+import re
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
                     datefmt='%m/%d/%Y %H:%M:%S %Z')
 logger = logging.getLogger(__name__)
@@ -6,4 +9,26 @@ logger = logging.getLogger(__name__)
 class CustomException(Exception):
     def __init__(self, err):
         self.message = err
-        super().__init__(err)
\ No newline at end of file
+        super().__init__(err)
+
+
+def resolve_inputs(inputs, extension):
+    """
+    Expand the input into the files to read, in reading order:
+    a list keeps its order, a directory gives its <extension> files and a glob its matches, both sorted by path
+    :param inputs: path, list of paths, directory or glob pattern, str
+    :param extension: file extension listed for a directory, i.e '.csv', str
+    :return input_files: file paths, list
+    """
+    if isinstance(inputs, (list, tuple)):
+        return [path for item in inputs for path in resolve_inputs(item, extension)]
+    inputs = os.fspath(inputs)
+    if os.path.isdir(inputs):
+        input_files = sorted(glob.glob(os.path.join(glob.escape(inputs), f'*{extension}')))
+    elif not os.path.exists(inputs) and re.search(r'[*?\[]', inputs):
+        input_files = sorted(glob.glob(inputs, recursive=True))
+    else:
+        return [inputs]
+    if not input_files:
+        raise ValueError(f"no {extension} files found for {inputs}")
+    return input_files
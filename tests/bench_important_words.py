@@ -0,0 +1,100 @@
+import argparse
+import numpy as np
+import os
+import sys
+import tempfile
+from src.important_words import word_search, word_search_stream, word_search_parallel, word_search_mmap, \
+    word_search_approximate
+from src.shared import logger
+from tests.benchmark import measure, add_baseline_arguments, finish
+
+########################################################################################################################
+# Benchmark suite for important_words
+# Usage: python -m tests.bench_important_words -m 1 10 100 -o words_baseline.json
+#        python -m tests.bench_important_words -m 1 10 100 -b words_baseline.json
+########################################################################################################################
+
+MIN_COUNT = 100
+SERIAL_MAX_MB = 100  # word_search needs the whole text and its word list in memory
+
+
+def make_zipf_corpus(path, megabytes, vocabulary_size=100_000, exponent=1.2, seed=0, block_words=1_000_000):
+    """
+    Write a space separated corpus whose word frequencies follow a Zipf distribution
+    :param path: text file to write, str
+    :param megabytes: approximate file size, int
+    :param vocabulary_size: number of distinct words, int
+    :param exponent: Zipf exponent, larger is more skewed, float
+    :param seed: random seed, int
+    :param block_words: words generated at a time, int
+    """
+    rng = np.random.default_rng(seed)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    vocabulary = np.array([''.join(rng.choice(letters, size=rng.integers(2, 12))) + str(rank)
+                           for rank in range(vocabulary_size)])
+    target = megabytes * 1_000_000
+    with open(path, 'w', encoding='utf-8') as out_file:
+        written = 0
+        while written < target:
+            ranks = (rng.zipf(exponent, size=block_words) - 1) % vocabulary_size
+            block = ' '.join(vocabulary[ranks])
+            block = block[:target - written] if written + len(block) + 1 > target else block + ' '
+            out_file.write(block)
+            written += len(block)
+
+
+def count_tokens(path):
+    """number of words of the corpus as split by word_search, int"""
+    spaces = 0
+    with open(path, 'rb') as in_file:
+        for block in iter(lambda: in_file.read(1 << 24), b''):
+            spaces += block.count(b' ')
+    return spaces + 1
+
+
+def run_mode(mode, path):
+    """Benchmarked call for one word_search mode"""
+    if mode == 'serial':
+        with open(path, encoding='utf-8', newline='') as in_file:
+            word_search(in_file.read(), MIN_COUNT)
+    elif mode == 'streaming':
+        word_search_stream(path, MIN_COUNT)
+    elif mode == 'parallel':
+        word_search_parallel(path, MIN_COUNT)
+    elif mode == 'mmap':
+        word_search_mmap(path, MIN_COUNT)
+    elif mode == 'approximate':
+        word_search_approximate(path, MIN_COUNT, capacity=10_000)
+    else:
+        raise ValueError(f"unknown benchmark mode {mode}")
+
+
+MODES = ('serial', 'streaming', 'parallel', 'mmap', 'approximate')
+
+
+def main(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_important_words_')
+    results = {}
+    for megabytes in args.megabytes:
+        path = os.path.join(work_dir, f'zipf_{megabytes}mb_{args.vocabulary}.txt')
+        if not os.path.exists(path):
+            logger.info(f'Generating {path}')
+            make_zipf_corpus(path, megabytes, args.vocabulary)
+        tokens = count_tokens(path)
+        for mode in args.modes:
+            if mode == 'serial' and megabytes > SERIAL_MAX_MB:
+                continue
+            key = f'{mode}/megabytes={megabytes}/vocabulary={args.vocabulary}'
+            results[key] = measure(run_mode, mode, path, repeat=args.repeat)
+            results[key]['tokens_per_second'] = round(tokens / results[key]['seconds'])
+            logger.info(f"{key}: {results[key]['tokens_per_second']:,} tokens/s, peak {results[key]['peak_rss_mb']} MB")
+    return finish(results, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Important Words Search benchmarks")
+    parser.add_argument('-m', '--megabytes', type=int, nargs='+', default=[1, 10, 100, 1000], help="corpus sizes in MB")
+    parser.add_argument('-v', '--vocabulary', type=int, action="store", default=100_000, help="distinct words in the corpus")
+    parser.add_argument('-c', '--modes', type=str, nargs='+', default=list(MODES), choices=MODES, help="word_search modes to time")
+    add_baseline_arguments(parser)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,98 @@
+import argparse
+import itertools
+import numpy as np
+import os
+import pandas as pd
+import sys
+import tempfile
+from src.pandas_df_manipulation import df_manipulation, district_subject_matrix, SubjectIndex
+from src.shared import logger
+from tests.benchmark import measure, add_baseline_arguments, finish
+
+########################################################################################################################
+# Benchmark suite for pandas_df_manipulation
+# Usage: python -m tests.bench_pandas_df_manipulation -n 10000 100000 -o baseline.json
+#        python -m tests.bench_pandas_df_manipulation -n 10000 100000 -b baseline.json
+########################################################################################################################
+
+MIN_SUBJECTS = 3
+QUERY_SUBJECTS = ['subject0', 'subject1', 'subject5']
+ITERROWS_MAX_ROWS = 100_000  # the row by row engine takes minutes past this
+
+
+def make_school_csv(path, rows, districts, subjects, seed=0, block_rows=1_000_000):
+    """
+    Write a synthetic school subjects csv, block by block so 10M rows fit in memory
+    :param path: csv to write, str
+    :param rows: number of schools, int
+    :param districts: number of distinct district codes, int
+    :param subjects: size of the subject vocabulary, int
+    :param seed: random seed, int
+    :param block_rows: rows generated at a time, int
+    """
+    rng = np.random.default_rng(seed)
+    district_codes = np.array([f'@d_{district}' for district in range(districts)])
+    vocabulary = np.array([f'subject{subject}' for subject in range(subjects)])
+    # schools share a limited number of subject lists, like real curricula
+    subject_lists = np.array([' '.join(rng.choice(vocabulary, size=rng.integers(1, min(8, subjects) + 1), replace=False))
+                              for _ in range(min(5000, 10 * subjects))])
+    for start in range(0, rows, block_rows):
+        size = min(block_rows, rows - start)
+        pd.DataFrame({
+            'school_code': [f'sc{school}' for school in range(start, start + size)],
+            'district_code': district_codes[rng.integers(0, districts, size)],
+            'subjects': subject_lists[rng.integers(0, len(subject_lists), size)],
+        }).to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+def run_case(case, input_csv):
+    """Benchmarked call for one engine or mode"""
+    if case == 'iterrows':
+        df_manipulation(input_csv, MIN_SUBJECTS, QUERY_SUBJECTS, engine='iterrows')
+    elif case == 'vectorized':
+        df_manipulation(input_csv, MIN_SUBJECTS, QUERY_SUBJECTS)
+    elif case == 'typed':
+        df_manipulation(input_csv, MIN_SUBJECTS, QUERY_SUBJECTS, engine='typed')
+    elif case == 'streaming':
+        df_manipulation(input_csv, MIN_SUBJECTS, QUERY_SUBJECTS, chunksize=100_000)
+    elif case == 'parallel':
+        df_manipulation(input_csv, MIN_SUBJECTS, QUERY_SUBJECTS, jobs=os.cpu_count())
+    elif case == 'index_build':
+        SubjectIndex.build(input_csv).save(f'{input_csv}.bench.npz')
+    elif case == 'index_query':
+        SubjectIndex.load_or_build(input_csv).query(MIN_SUBJECTS, QUERY_SUBJECTS)
+    elif case == 'all_subjects':
+        district_subject_matrix(input_csv, MIN_SUBJECTS)
+    else:
+        raise ValueError(f"unknown benchmark case {case}")
+
+
+CASES = ('iterrows', 'vectorized', 'typed', 'streaming', 'parallel', 'index_build', 'index_query', 'all_subjects')
+
+
+def main(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_df_manipulation_')
+    results = {}
+    for rows, districts, subjects in itertools.product(args.rows, args.districts, args.subjects):
+        input_csv = os.path.join(work_dir, f'schools_{rows}_{districts}_{subjects}.csv')
+        if not os.path.exists(input_csv):
+            logger.info(f'Generating {input_csv}')
+            make_school_csv(input_csv, rows, districts, subjects)
+        SubjectIndex.load_or_build(input_csv)  # index_query times the warm index
+        for case in args.cases:
+            if case == 'iterrows' and rows > ITERROWS_MAX_ROWS:
+                continue
+            key = f'{case}/rows={rows}/districts={districts}/subjects={subjects}'
+            results[key] = measure(run_case, case, input_csv, repeat=args.repeat)
+            logger.info(f"{key}: {results[key]['seconds']:.3f}s, peak {results[key]['peak_rss_mb']} MB")
+    return finish(results, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pandas Dataframe Manipulation benchmarks")
+    parser.add_argument('-n', '--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 10_000_000], help="schools per generated csv")
+    parser.add_argument('-d', '--districts', type=int, nargs='+', default=[100, 10_000], help="distinct district codes")
+    parser.add_argument('-s', '--subjects', type=int, nargs='+', default=[20, 500], help="subject vocabulary sizes")
+    parser.add_argument('-c', '--cases', type=str, nargs='+', default=list(CASES), choices=CASES, help="engines and modes to time")
+    add_baseline_arguments(parser)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,75 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from src.pdf_splitting import PdfSplitting
+from src.shared import logger
+from tests.benchmark import measure, add_baseline_arguments, finish
+
+########################################################################################################################
+# Benchmark suite for pdf_splitting
+# Usage: python -m tests.bench_pdf_splitting -n 100 1000 -g 1 10 100 -z -o pdf_baseline.json
+#        python -m tests.bench_pdf_splitting -n 100 1000 -g 1 10 100 -b pdf_baseline.json
+########################################################################################################################
+
+
+def make_pdf(path, pages, lines_per_page=40):
+    """
+    Write a pdf with a few lines of text on every page
+    :param path: pdf file to write, str
+    :param pages: number of pages, int
+    :param lines_per_page: text lines per page, int
+    """
+    pdf = canvas.Canvas(path, pagesize=letter)
+    for page in range(pages):
+        for line in range(lines_per_page):
+            pdf.drawString(72, 750 - line * 16, f"Page {page} line {line} of the generated benchmark document")
+        pdf.showPage()
+    pdf.save()
+
+
+def run_split(path, out_folder, pages_per_file, jobs, optimize=False):
+    """Benchmarked call, one file per page when pages_per_file is 1"""
+    shutil.rmtree(out_folder, ignore_errors=True)
+    os.makedirs(out_folder)
+    PdfSplitting().split_pdf(path, out_folder, jobs=jobs, pages_per_file=None if pages_per_file == 1 else pages_per_file,
+                             optimize=optimize)
+
+
+def folder_bytes(folder):
+    """total size of the files in a folder, int"""
+    return sum(entry.stat().st_size for entry in os.scandir(folder))
+
+
+def main(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_pdf_splitting_')
+    results = {}
+    for pages in args.pages:
+        path = os.path.join(work_dir, f'generated_{pages}.pdf')
+        if not os.path.exists(path):
+            logger.info(f'Generating {path}')
+            make_pdf(path, pages)
+        for pages_per_file, optimize in [(group, optimize) for group in args.pages_per_file
+                                         for optimize in ([False, True] if args.optimize else [False])]:
+            key = f'pages={pages}/pages_per_file={pages_per_file}/jobs={args.jobs}/optimize={optimize}'
+            out_folder = os.path.join(work_dir, f'out_{pages}_{pages_per_file}_{optimize}')
+            results[key] = measure(run_split, path, out_folder, pages_per_file, args.jobs, optimize, repeat=args.repeat)
+            results[key]['files'] = len(os.listdir(out_folder))
+            results[key]['output_mb'] = round(folder_bytes(out_folder) / 1e6, 3)
+            results[key]['pages_per_second'] = round(pages / results[key]['seconds'])
+            logger.info(f"{key}: {results[key]['pages_per_second']:,} pages/s, {results[key]['files']} files, "
+                        f"{results[key]['output_mb']} MB, peak {results[key]['peak_rss_mb']} MB")
+    return finish(results, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PDF Splitting benchmarks")
+    parser.add_argument('-n', '--pages', type=int, nargs='+', default=[100, 1000], help="input pdf page counts")
+    parser.add_argument('-g', '--pages_per_file', type=int, nargs='+', default=[1, 10, 100], help="pages per output file, 1 is single page output")
+    parser.add_argument('-j', '--jobs', type=int, action="store", default=1, help="worker processes of split_pdf")
+    parser.add_argument('-z', '--optimize', action="store_true", help="also time the optimized (compressed) output")
+    add_baseline_arguments(parser)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,110 @@
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from src.shared import logger
+
+########################################################################################################################
+# Benchmark helpers shared by the tests/bench_*.py suites
+# every case runs in a fresh spawned process so its peak memory is not hidden by earlier cases
+########################################################################################################################
+
+
+def _peak_rss_mb():
+    """peak resident memory of this process and its finished child processes, MB"""
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KB on linux
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    try:
+        # linux carries ru_maxrss of RUSAGE_SELF over from the parent through fork and exec, VmHWM starts afresh
+        with open('/proc/self/status') as status:
+            own = next(int(line.split()[1]) * 1024 for line in status if line.startswith('VmHWM:'))
+    except OSError:
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return max(own, children) / 1e6
+
+
+def _timed_runs(func, args, repeat):
+    """Child process entry point, best wall time of <repeat> calls and the peak memory"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return {'seconds': min(timings), 'peak_rss_mb': round(_peak_rss_mb(), 1)}
+
+
+def measure(func, *args, repeat=3):
+    """
+    Time a module level function in a fresh process
+    :param func: picklable function to benchmark, callable
+    :param args: arguments for func
+    :param repeat: number of calls, the fastest one is reported, int
+    :return result: best wall time in seconds and peak resident memory in MB, dict
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_timed_runs, func, args, repeat).result()
+
+
+def environment():
+    """versions recorded next to the results, timings are only comparable on the same machine"""
+    import numpy
+    import pandas
+    return {'python': platform.python_version(), 'numpy': numpy.__version__, 'pandas': pandas.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(),
+            'cpu_count': multiprocessing.cpu_count()}
+
+
+def save_baseline(path, results):
+    """
+    :param path: json file to write, str
+    :param results: benchmark results keyed by case, dict
+    """
+    with open(path, 'w') as out_file:
+        json.dump({'environment': environment(), 'results': results}, out_file, indent=2, sort_keys=True)
+    logger.info(f'Saved {len(results)} benchmark results to {path}')
+
+
+def compare_to_baseline(results, path, tolerance):
+    """
+    Flag cases which got slower than the saved baseline
+    :param results: benchmark results keyed by case, dict
+    :param path: baseline json file, str
+    :param tolerance: allowed slowdown as a fraction of the baseline time, float
+    :return regressions: keys of the slower cases, list
+    """
+    with open(path) as in_file:
+        baseline = json.load(in_file)['results']
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result['seconds'] / max(baseline[key]['seconds'], 1e-9)
+        if ratio > 1 + tolerance:
+            logger.warning(f"{key}: {result['seconds']:.3f}s vs baseline {baseline[key]['seconds']:.3f}s ({ratio:.2f}x)")
+            regressions.append(key)
+    return regressions
+
+
+def add_baseline_arguments(parser):
+    """common command line options of the benchmark suites"""
+    parser.add_argument('-r', '--repeat', type=int, action="store", default=3, help="calls per case, the fastest is kept")
+    parser.add_argument('-o', '--out', type=str, action="store", default=None, help="write the results to this json baseline")
+    parser.add_argument('-b', '--baseline', type=str, action="store", default=None, help="compare the results to this json baseline")
+    parser.add_argument('-t', '--tolerance', type=float, action="store", default=0.2, help="allowed slowdown vs the baseline, fraction")
+    parser.add_argument('-w', '--work_dir', type=str, action="store", default=None, help="folder for the generated inputs")
+
+
+def finish(results, args):
+    """save and/or compare the results as requested on the command line, returns the process exit code"""
+    if args.out:
+        save_baseline(args.out, results)
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            logger.error(f'{len(regressions)} benchmark cases are slower than {args.baseline}')
+            return 1
+        logger.info(f'No benchmark case is slower than {args.baseline}')
+    return 0
@@ -1,7 +1,10 @@
 
-from tests.conftest import pytest, patch, Mock
+import io
+from collections import defaultdict
 
-from src.important_words import word_search
+from tests.conftest import pytest, patch, Mock, create_general_test_file
+
+from src.important_words import *
 
 @pytest.mark.parametrize(
     'args, expected',
@@ -21,4 +24,247 @@ from src.important_words import word_search
 )
 def test_word_search(args, expected):
     result = word_search(args[0], args[1])
-    assert result == expected
\ No newline at end of file
+    assert result == expected
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 7, 1000])
+@pytest.mark.parametrize(
+    'text, k',
+    [
+        ("this is a sentence that is separated by spaces that has at least one word that is found at least three times", 2),
+        ("this is a sentence that is separated by spaces that has at least one word that is found at least three times", 3),
+        ("  double  spaces and\nnew lines\nand trailing spaces  ", 1),
+        ("", 1),
+        ("naïve café naïve ", 2),
+    ]
+)
+def test_word_search_stream(text, k, chunk_size, create_general_test_file):
+    create_general_test_file.write_text(text, encoding='utf-8')
+    assert word_search_stream(f'{create_general_test_file}', k, chunk_size) == word_search(text, k)
+    assert word_search_stream(io.StringIO(text), k, chunk_size) == word_search(text, k)
+    assert word_search_stream(create_general_test_file, k, chunk_size) == word_search(text, k)  # a pathlib.Path
+
+
+def test_word_search_stream_stdin():
+    with patch('sys.stdin', io.StringIO("a b a c b a")):
+        assert word_search_stream('-', 2) == ['a', 'b']
+
+
+@pytest.mark.parametrize('jobs', [1, 2, 3, 8])
+@pytest.mark.parametrize(
+    'text, k',
+    [
+        ("this is a sentence that is separated by spaces that has at least one word that is found at least three times", 2),
+        ("  double  spaces and\nnew lines\nand trailing spaces  ", 1),
+        ("nospacesatall", 1),
+        ("", 1),
+        ("naïve café naïve ", 2),
+    ]
+)
+def test_word_search_parallel(text, k, jobs, create_general_test_file):
+    create_general_test_file.write_text(text, encoding='utf-8')
+    assert word_search_parallel(f'{create_general_test_file}', k, jobs) == word_search(text, k)
+
+
+@pytest.mark.parametrize(
+    'text, k, capacity',
+    [
+        ("this is a sentence that is separated by spaces that has at least one word that is found at least three times", 3, 8),
+        ("a b c a d e a f g a h i b b b", 4, 3),
+        ("  double  spaces and\nnew lines\nand trailing spaces  ", 2, 6),
+    ]
+)
+def test_word_search_approximate(text, k, capacity, create_general_test_file):
+    # k is above the error bound len(words) / (capacity + 1), so the answer is exact
+    assert k > len(text.split(' ')) / (capacity + 1)
+    create_general_test_file.write_text(text, encoding='utf-8')
+    assert word_search_approximate(f'{create_general_test_file}', k, capacity, chunk_size=4) == word_search(text, k)
+    assert word_search_approximate(io.StringIO(text), k, capacity) == word_search(text, k)
+    assert word_search_approximate(create_general_test_file, k, capacity) == word_search(text, k)
+
+
+def test_word_search_approximate_not_seekable():
+    stream = Mock(seekable=Mock(return_value=False))
+    with pytest.raises(ValueError):
+        word_search_approximate(stream, 2)
+    stream.read.assert_not_called()
+    with patch('sys.stdin', stream), pytest.raises(ValueError):
+        word_search_approximate('-', 2)
+
+
+def test_word_search_approximate_below_bound():
+    text = "a b c d e f a b c d e f z z"
+    # the summary has 2 counters, words at least twice may be missed but every returned word is verified
+    with patch('src.important_words.logger') as logger:
+        result = word_search_approximate(io.StringIO(text), 2, capacity=2)
+        logger.warning.assert_called_once()
+    assert set(result) <= set(word_search(text, 2))
+
+
+def test_misra_gries_bounds():
+    text = "a b a c a d b a e b a f"
+    counters, total = misra_gries(io.StringIO(text), 2)
+    assert total == 12 and len(counters) <= 2
+    counts = {word: text.split(' ').count(word) for word in set(text.split(' '))}
+    for word, estimate in counters.items():
+        assert counts[word] - total / 3 <= estimate <= counts[word]
+    assert 'a' in counters  # 5 > 12 / 3
+
+
+class TestImportantWordsTracker:
+    def test_add_expire(self):
+        tracker = ImportantWordsTracker(2)
+        tracker.add("this is a sentence that is")
+        tracker.add("that has at least one word")
+        assert tracker.important_words() == ['is', 'that']
+        tracker.add("at least")
+        assert tracker.important_words() == ['is', 'that', 'at', 'least']
+        assert tracker.important_words(3) == []
+        tracker.expire("this is a sentence that is")
+        assert tracker.important_words() == ['at', 'least']
+        assert tracker.important_words(1) == ['that', 'has', 'at', 'least', 'one', 'word']
+        with pytest.raises(ValueError):
+            tracker.expire("never added")
+
+    def test_matches_word_search(self):
+        text = "this is a sentence that is separated by spaces that has at least one word that is found at least three times"
+        tracker = ImportantWordsTracker(2)
+        for document in text.split(' '):
+            tracker.add(document)
+        for k in range(1, 5):
+            assert tracker.important_words(k) == word_search(text, k)
+
+    def test_max_documents(self):
+        tracker = SlidingWindowTracker(2, max_documents=2)
+        tracker.add("a b")
+        tracker.add("b c")
+        assert tracker.important_words() == ['b']
+        tracker.add("c d")
+        assert tracker.important_words() == ['c']
+        assert tracker.counts == {'b': 1, 'c': 2, 'd': 1}
+
+    def test_expire_is_atomic(self):
+        tracker = ImportantWordsTracker(1)
+        tracker.add("a b a")
+        with pytest.raises(ValueError):
+            tracker.expire("a never_added")
+        with pytest.raises(ValueError):
+            tracker.expire("b b")
+        assert tracker.counts == {'a': 2, 'b': 1}
+        assert tracker.important_words(2) == ['a']
+
+    @pytest.mark.parametrize('max_documents', [1, 2, 3])
+    def test_window_matches_word_search(self, max_documents):
+        documents = ["a b", "c", "a", "b c b", "d a", "c", "a d d"]
+        tracker = SlidingWindowTracker(1, max_documents=max_documents)
+        for position, document in enumerate(documents):
+            tracker.add(document)
+            window = ' '.join(documents[max(0, position + 1 - max_documents):position + 1])
+            for k in range(1, 4):
+                assert tracker.important_words(k) == word_search(window, k)
+
+    def test_max_seconds(self):
+        tracker = SlidingWindowTracker(2, max_seconds=60, clock=Mock(return_value=100))
+        tracker.add("a b", timestamp=0)
+        tracker.add("a c", timestamp=30)
+        assert tracker.important_words(now=59) == ['a']
+        assert tracker.important_words(now=61) == []
+        assert tracker.important_words(1) == []  # clock says 100, both documents are too old
+
+
+class TestWordIndex:
+    text = "this is a sentence that is separated by spaces that has at least one word that is found at least three times"
+
+    def test_thresholds_match_word_search(self):
+        index = WordIndex.from_text(self.text)
+        assert index.thresholds([1, 2, 3, 4, 5]) == {k: word_search(self.text, k) for k in [1, 2, 3, 4, 5]}
+
+    def test_from_file(self, create_general_test_file):
+        create_general_test_file.write_text(self.text)
+        assert WordIndex.from_file(f'{create_general_test_file}', chunk_size=3).counts == WordIndex.from_text(self.text).counts
+        assert WordIndex.from_file(create_general_test_file).counts == WordIndex.from_text(self.text).counts
+
+    @pytest.mark.parametrize('n, expected', [
+        (0, []),
+        (2, [('is', 3), ('that', 3)]),
+        (4, [('is', 3), ('that', 3), ('at', 2), ('least', 2)]),
+        (5, [('is', 3), ('that', 3), ('at', 2), ('least', 2), ('this', 1)]),
+    ])
+    def test_top_k(self, n, expected):
+        assert WordIndex.from_text(self.text).top_k(n) == expected
+
+
+@pytest.mark.parametrize('k', [1, 2, 3])
+def test_word_search_batch(k):
+    documents = [
+        "this is a sentence that is separated by spaces that has at least one word that is found at least three times",
+        "a b a b a",
+        "",
+        "  double  spaces and\nnew lines\nand trailing spaces  ",
+        "one",
+    ]
+    assert word_search_batch(documents, k) == [word_search(document, k) for document in documents]
+
+    series = pd.Series(documents + [None], index=[10, 11, 12, 13, 14, 15])
+    result = word_search_batch(series, k)
+    assert result.index.equals(series.index)
+    assert result.tolist() == [word_search(document, k) for document in documents] + [[]]
+
+
+def test_word_search_batch_empty():
+    assert word_search_batch([], 1) == []
+    assert word_search_batch(pd.Series([None, None]), 1).tolist() == [[], []]
+
+
+@pytest.mark.parametrize('block_size', [1, 3, 1000])
+@pytest.mark.parametrize(
+    'text, k',
+    [
+        ("this is a sentence that is separated by spaces that has at least one word that is found at least three times", 2),
+        ("  double  spaces and\nnew lines\nand trailing spaces  ", 1),
+        ("nospacesatall", 1),
+        ("", 1),
+        (" ", 2),
+        ("naïve café naïve ", 2),
+    ]
+)
+def test_word_search_mmap(text, k, block_size, create_general_test_file):
+    create_general_test_file.write_text(text, encoding='utf-8')
+    assert word_search_mmap(f'{create_general_test_file}', k, block_size) == word_search(text, k)
+
+
+def naive_phrase_search(text, k, n):
+    words = text.split(' ')
+    phrase_dict = defaultdict(int)
+    for start in range(len(words) - n + 1):
+        phrase_dict[tuple(words[start:start + n])] += 1
+    return [' '.join(phrase) for phrase in phrase_dict if phrase_dict[phrase] >= k]
+
+
+@pytest.mark.parametrize('n', [1, 2, 3])
+@pytest.mark.parametrize(
+    'text, k',
+    [
+        ("this is a sentence that is separated by spaces that has at least one word that is found at least three times", 2),
+        ("a b a b a b c a b", 2),
+        ("a b a b a b c a b", 3),
+        ("  double  spaces  double  spaces", 1),
+        ("one", 1),
+    ]
+)
+def test_phrase_search(text, k, n):
+    assert phrase_search(text, k, n) == naive_phrase_search(text, k, n)
+    if n == 1:
+        assert phrase_search(text, k, n) == word_search(text, k)
+
+
+def test_phrase_search_large_keys():
+    # 5000 ** 6 does not fit in 64 bits, the phrase keys are still exact
+    words = [f'w{index % 5000}' for index in range(12000)]
+    text = ' '.join(words + words[:20])
+    assert phrase_search(text, 2, 6) == naive_phrase_search(text, 2, 6)
+
+
+@pytest.mark.parametrize('n', [0, -1])
+def test_phrase_search_invalid_n(n):
+    with pytest.raises(ValueError):
+        phrase_search("a b", 1, n)
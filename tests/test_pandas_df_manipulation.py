@@ -1,8 +1,9 @@
 import pandas as pd
 
-from tests.conftest import pytest, create_general_test_file
+from tests.conftest import pytest, patch, create_general_test_file
 
 from src.pandas_df_manipulation import *
+from src.pandas_df_manipulation import _byte_ranges, _ByteRangeReader
 
 input_data = (f'school_code,district_code,subjects\n'
               f'sc1,@*dt1,biology history\n'
@@ -14,6 +15,15 @@ input_data = (f'school_code,district_code,subjects\n'
               f'sc3,@*dt1,history health biology\n'
               f'sc8,^^dt3,literature speech economics\n')
 
+# numeric only district codes and an empty subjects cell, read one row at a time pandas would parse them as numbers
+numeric_data = (f'school_code,district_code,subjects\n'
+                f'sc1,@dt1,mathematics biology\n'
+                f'sc2,1234,mathematics\n'
+                f'sc3,1234,\n'
+                f'sc4,@dt1,biology\n')
+numeric_expected = pd.DataFrame({'district_code': ['dt1', '1234'], 'mathematics': [1, 1], 'biology': [2, 0]})
+
+@pytest.mark.parametrize('engine', ENGINES)
 @pytest.mark.parametrize(
     'in2, in3, expected', [
         (
@@ -35,14 +45,262 @@ input_data = (f'school_code,district_code,subjects\n'
         )
     ]
 )
-def test_df_manipulation(in2, in3, expected, create_general_test_file, tmp_path):
+def test_df_manipulation(in2, in3, expected, engine, create_general_test_file, tmp_path):
     input_csv = create_general_test_file
     input_csv.write_text(input_data)
     fake_result = {'district_code': ['dt5', 'dt1', 'dt2'], 'mathematics': [1, 2, 1], 'biology': [3, 0, 1]}
 
     # from time import time
     # start = time()
-    actual = df_manipulation(f'{tmp_path}/file.ext', in2, in3)
+    actual = df_manipulation(f'{tmp_path}/file.ext', in2, in3, engine=engine)
     # print(f"Script took {time() - start} seconds")
     assert actual.equals(pd.DataFrame(expected))
-    assert not actual.equals(pd.DataFrame(fake_result))
\ No newline at end of file
+    assert not actual.equals(pd.DataFrame(fake_result))
+
+@pytest.mark.parametrize(
+    'in2, in3', [
+        (1, ['biology', 'economics', 'speech']),
+        (2, ['mathematics', 'biology']),
+        (4, ['biology']),  # no school offers 4 subjects
+        (2, []),
+    ]
+)
+def test_engines_match(in2, in3, create_general_test_file, tmp_path):
+    input_csv = create_general_test_file
+    # repeated subjects and double spaces are treated the same way by both engines
+    input_csv.write_text(input_data + 'sc9,dt_4,biology  biology\n' + 'sc10,#dt5,speech speech\n')
+    vectorized = df_manipulation(f'{tmp_path}/file.ext', in2, in3)
+    iterrows = df_manipulation(f'{tmp_path}/file.ext', in2, in3, engine='iterrows')
+    assert vectorized.equals(iterrows)
+
+
+def test_unknown_engine(create_general_test_file, tmp_path):
+    create_general_test_file.write_text(input_data)
+    with pytest.raises(ValueError):
+        df_manipulation(f'{tmp_path}/file.ext', 2, ['biology'], engine='spark')
+
+
+@pytest.mark.parametrize('chunksize', [1, 3, 8, 100])
+@pytest.mark.parametrize(
+    'in2, in3', [
+        (2, ['mathematics', 'biology']),
+        (3, ['biology', 'history', 'literature']),
+        (4, ['biology']),
+    ]
+)
+def test_streaming_matches(in2, in3, chunksize, create_general_test_file, tmp_path):
+    create_general_test_file.write_text(input_data)
+    expected = df_manipulation(f'{tmp_path}/file.ext', in2, in3)
+    actual = df_manipulation(f'{tmp_path}/file.ext', in2, in3, chunksize=chunksize)
+    assert actual.equals(expected)
+
+
+@pytest.mark.parametrize('jobs, chunksize', [(2, None), (3, 2), (16, None)])
+@pytest.mark.parametrize(
+    'in2, in3', [
+        (2, ['mathematics', 'biology']),
+        (3, ['biology', 'history', 'literature']),
+    ]
+)
+def test_parallel_matches(in2, in3, jobs, chunksize, create_general_test_file, tmp_path):
+    create_general_test_file.write_text(input_data)
+    expected = df_manipulation(f'{tmp_path}/file.ext', in2, in3)
+    actual = df_manipulation(f'{tmp_path}/file.ext', in2, in3, chunksize=chunksize, jobs=jobs)
+    assert actual.equals(expected)
+
+
+@pytest.mark.parametrize('engine, chunksize, jobs', [
+    ('vectorized', None, 1), ('vectorized', 1, 1), ('vectorized', 2, 1), ('vectorized', None, 4),
+    ('vectorized', 1, 3), ('typed', None, 1),
+])
+def test_numeric_only_chunks(engine, chunksize, jobs, create_general_test_file, tmp_path):
+    """chunks and byte ranges holding only numeric district codes or empty subjects are still read as strings"""
+    create_general_test_file.write_text(numeric_data)
+    actual = df_manipulation(f'{tmp_path}/file.ext', 1, ['mathematics', 'biology'], engine=engine,
+                             chunksize=chunksize, jobs=jobs)
+    assert actual.equals(numeric_expected)
+
+
+def test_byte_ranges(create_general_test_file, tmp_path):
+    create_general_test_file.write_text(input_data)
+    header, ranges = _byte_ranges(f'{tmp_path}/file.ext', 3)
+    raw = input_data.encode()
+    assert header == raw[:raw.index(b'\n') + 1]
+    assert ranges[0][0] == len(header) and ranges[-1][1] == len(raw)
+    for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert end == next_start and raw[end - 1:end] == b'\n'
+
+
+@pytest.mark.parametrize(
+    'in2, in3', [
+        (2, ['mathematics', 'biology']),
+        (3, ['biology', 'history', 'literature']),
+        (1, ['economics', 'astronomy']),  # astronomy is not in the csv
+        (4, ['biology']),
+    ]
+)
+def test_index_matches(in2, in3, create_general_test_file, tmp_path):
+    create_general_test_file.write_text(input_data)
+    expected = df_manipulation(f'{tmp_path}/file.ext', in2, in3)
+    assert df_manipulation(f'{tmp_path}/file.ext', in2, in3, use_index=True).equals(expected)
+    assert SubjectIndex.load(f'{tmp_path}/file.ext.idx.npz').query(in2, in3).equals(expected)
+    os.remove(f'{tmp_path}/file.ext.idx.npz')
+
+
+def test_index_rebuilt_on_change(create_general_test_file, tmp_path):
+    input_csv = create_general_test_file
+    input_csv.write_text(input_data)
+    index_path = f'{tmp_path}/subjects.npz'
+    first = SubjectIndex.load_or_build(f'{input_csv}', index_path)
+    assert first.query(1, ['speech'])['speech'].tolist() == [0, 0, 1]
+
+    # touching the csv keeps the index since the contents hash is unchanged
+    os.utime(input_csv, ns=(first.source['mtime_ns'] + 10**9, first.source['mtime_ns'] + 10**9))
+    with patch.object(SubjectIndex, 'build') as build:
+        SubjectIndex.load_or_build(f'{input_csv}', index_path)
+        build.assert_not_called()
+
+    input_csv.write_text(input_data + 'sc9,dt_4,speech\n')
+    rebuilt = SubjectIndex.load_or_build(f'{input_csv}', index_path)
+    assert rebuilt.query(1, ['speech'])['speech'].tolist() == [0, 0, 1, 1]
+    assert SubjectIndex.load(index_path).source == rebuilt.source
+    os.remove(index_path)
+
+
+@pytest.mark.parametrize(
+    'in2, in3', [
+        (2, ['mathematics', 'biology']),
+        (3, ['biology', 'history', 'literature']),
+        (1, ['economics', 'astronomy']),
+        (4, ['biology']),
+    ]
+)
+def test_typed_engine_matches(in2, in3, create_general_test_file, tmp_path):
+    create_general_test_file.write_text(input_data + 'sc9,dt_4,biology  biology\n' + 'sc10,#dt5,speech speech\n')
+    expected = df_manipulation(f'{tmp_path}/file.ext', in2, in3)
+    assert df_manipulation(f'{tmp_path}/file.ext', in2, in3, engine='typed').equals(expected)
+
+
+def test_load_school_subjects(create_general_test_file, tmp_path):
+    create_general_test_file.write_text(input_data)
+    school_subjects = load_school_subjects(f'{tmp_path}/file.ext')
+    assert list(school_subjects.districts) == ['dt1', 'dt2', 'dt1', 'dt3', 'dt2', 'dt3', 'dt1', 'dt3']
+    assert list(school_subjects.districts.categories) == ['dt1', 'dt2', 'dt3']
+    assert school_subjects.subjects.tolist() == ['biology', 'history', 'mathematics', 'literature', 'economics',
+                                                 'health', 'speech']
+    assert school_subjects.subject_counts.tolist() == [2, 1, 3, 2, 3, 2, 3, 3]
+    assert school_subjects.set_tokens.dtype == np.int32
+    assert school_subjects.memory_usage() > 0
+
+
+@pytest.mark.parametrize('in2', [1, 2, 3, 4])
+def test_district_subject_matrix(in2, create_general_test_file, tmp_path):
+    create_general_test_file.write_text(input_data + 'sc9,dt_4,biology  biology\n')
+    all_subjects = ['biology', 'history', 'mathematics', 'literature', 'economics', 'health', 'speech', '']
+    expected = df_manipulation(f'{tmp_path}/file.ext', in2, all_subjects)
+    dense = district_subject_matrix(f'{tmp_path}/file.ext', in2, dense=True)
+    assert list(dense.columns) == ['district_code'] + all_subjects
+    assert dense.astype({sub: object for sub in all_subjects}).equals(expected.astype({sub: object for sub in all_subjects}))
+
+    sparse = df_manipulation(f'{tmp_path}/file.ext', in2, None)
+    assert all(isinstance(sparse[sub].dtype, pd.SparseDtype) for sub in all_subjects) or len(sparse) == 0
+    assert sparse.astype({sub: 'int64' for sub in all_subjects}).equals(dense)
+
+
+@pytest.mark.parametrize('dense', [True, False])
+def test_district_subject_matrix_blank_district(dense, create_general_test_file, tmp_path):
+    # the blank district must not be counted for the last district, dtZ
+    create_general_test_file.write_text('school_code,district_code,subjects\nsc1,dtA,math\nsc2,,bio\n'
+                                        'sc3,dt1,bio\nsc4,dtZ,math\n')
+    with pytest.raises(ValueError, match='without a district_code'):
+        district_subject_matrix(f'{tmp_path}/file.ext', 1, dense=dense)
+    with pytest.raises(ValueError):
+        df_manipulation(f'{tmp_path}/file.ext', 1, ['bio'], engine='typed')
+
+
+def test_district_subject_matrix_density(create_general_test_file, tmp_path):
+    create_general_test_file.write_text(input_data)
+    # 13 of the 21 counts are non-zero, so the matrix stays dense unless the threshold is raised
+    assert not any(isinstance(dtype, pd.SparseDtype) for dtype in district_subject_matrix(f'{tmp_path}/file.ext', 1).dtypes)
+    matrix = district_subject_matrix(f'{tmp_path}/file.ext', 1, sparse_density=0.9)
+    assert matrix['speech'].sparse.density == pytest.approx(1 / 3)
+
+
+def test_incremental_aggregator(create_general_test_file, tmp_path):
+    input_csv = create_general_test_file
+    rows = input_data.splitlines(keepends=True)
+    query = ['mathematics', 'biology', 'speech']
+    state_path = f'{tmp_path}/state.json'
+    input_csv.write_text(''.join(rows[:4]) + rows[4][:6])  # last row only partly written
+    assert IncrementalAggregator(f'{input_csv}', 2, query, state_path).update().equals(
+        pd.DataFrame({'district_code': ['dt1'], 'mathematics': [1], 'biology': [2], 'speech': [0]}))
+
+    input_csv.write_text(''.join(rows))
+    aggregator = IncrementalAggregator(f'{input_csv}', 2, query, state_path)
+    assert aggregator.offset == len(''.join(rows[:4]))
+    with patch('src.pandas_df_manipulation._ByteRangeReader', wraps=_ByteRangeReader) as range_reader:
+        assert aggregator.update().equals(df_manipulation(f'{input_csv}', 2, query))
+        # only the appended rows are parsed
+        range_reader.assert_called_once_with(f'{input_csv}', rows[0].encode(), len(''.join(rows[:4])),
+                                             len(''.join(rows)))
+    assert aggregator.update().equals(df_manipulation(f'{input_csv}', 2, query))
+
+    # a rewritten csv is counted again from the start
+    input_csv.write_text(rows[0] + rows[1])
+    assert IncrementalAggregator(f'{input_csv}', 2, query, state_path).update().equals(
+        df_manipulation(f'{input_csv}', 2, query))
+    os.remove(state_path)
+
+
+def test_incremental_aggregator_unterminated_last_row(create_general_test_file, tmp_path):
+    input_csv = create_general_test_file
+    query = ['mathematics', 'speech']  # speech is only offered in the last row
+    input_csv.write_text(input_data.rstrip('\n'))  # the final row has no trailing newline
+    aggregator = IncrementalAggregator(f'{input_csv}', 2, query, f'{tmp_path}/state.json')
+    # the row could still be growing, it is counted once the next update finds the same file size
+    assert not aggregator.update().equals(df_manipulation(f'{input_csv}', 2, query))
+    assert IncrementalAggregator(f'{input_csv}', 2, query, f'{tmp_path}/state.json').update().equals(
+        df_manipulation(f'{input_csv}', 2, query))
+    # a row appended after the newline the writer adds is counted once, the finished row is not counted again
+    input_csv.write_text(input_data + 'sc9,dt4,mathematics biology\n')
+    assert IncrementalAggregator(f'{input_csv}', 2, query, f'{tmp_path}/state.json').update().equals(
+        df_manipulation(f'{input_csv}', 2, query))
+
+
+@pytest.mark.parametrize('engine, jobs, use_index', [
+    ('vectorized', 1, False), ('vectorized', 3, False), ('typed', 2, False), ('iterrows', 1, False),
+    ('vectorized', 2, True),
+])
+def test_multi_file_inputs(engine, jobs, use_index, create_general_test_file, tmp_path):
+    create_general_test_file.write_text(input_data)
+    rows = input_data.splitlines(keepends=True)
+    region_dir = tmp_path / 'regions'
+    region_dir.mkdir()
+    # files are read in sorted order, region_b holds the first rows so dt1 is still seen first
+    (region_dir / 'region_b.csv').write_text(''.join(rows[:4]))
+    (region_dir / 'region_c.csv').write_text(rows[0] + ''.join(rows[4:7]))
+    (region_dir / 'region_d.csv').write_text(rows[0] + ''.join(rows[7:]))
+    (region_dir / 'notes.txt').write_text('not a csv')
+    query = ['mathematics', 'biology', 'literature']
+    expected = df_manipulation(f'{tmp_path}/file.ext', 2, query)
+    for input_csv in (f'{region_dir}', f'{region_dir}/region_*.csv',
+                      [f'{region_dir}/region_b.csv', f'{region_dir}/region_c.csv', f'{region_dir}/region_d.csv']):
+        assert df_manipulation(input_csv, 2, query, engine=engine, jobs=jobs, use_index=use_index).equals(expected)
+
+    # a region file whose district codes are all numeric
+    numeric_dir = tmp_path / 'numeric_regions'
+    numeric_dir.mkdir()
+    (numeric_dir / 'a.csv').write_text('school_code,district_code,subjects\nsc1,@dt1,mathematics biology\n')
+    (numeric_dir / 'b.csv').write_text('school_code,district_code,subjects\nsc2,1234,mathematics\nsc3,1234,biology\n')
+    assert df_manipulation(f'{numeric_dir}', 1, ['mathematics', 'biology'], engine=engine, jobs=jobs,
+                           use_index=use_index).equals(
+        pd.DataFrame({'district_code': ['dt1', '1234'], 'mathematics': [1, 1], 'biology': [1, 1]}))
+
+
+def test_multi_file_ordering(tmp_path):
+    (tmp_path / 'a.csv').write_text('school_code,district_code,subjects\nsc1,dt9,biology\n')
+    (tmp_path / 'b.csv').write_text('school_code,district_code,subjects\nsc2,dt1,biology\nsc3,dt9,biology\n')
+    assert df_manipulation(f'{tmp_path}', 1, ['biology'])['district_code'].tolist() == ['dt9', 'dt1']
+    assert df_manipulation([f'{tmp_path}/b.csv', f'{tmp_path}/a.csv'], 1, ['biology'])['district_code'].tolist() == ['dt1', 'dt9']
+    with pytest.raises(ValueError):
+        df_manipulation(f'{tmp_path}/*.tsv', 1, ['biology'])
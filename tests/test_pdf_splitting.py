@@ -1,9 +1,10 @@
 # from os.path import split
 # import os
 # from os.path import split
+import io
 from unittest.mock import MagicMock
 
-from tests.conftest import multi_page_pdf, pytest, patch, Mock
+from tests.conftest import multi_page_pdf, pytest, patch, Mock, canvas
 from src.pdf_splitting import *
 
 @pytest.fixture(scope="function")
@@ -65,6 +66,196 @@ class TestPdfSplitting:
         res = CustomPDFSplitter().filter_pages(mock_pdf_source, includes=["INCLUDE THIS TEXT", "ANOTHER TEXT TO INCLUDE"], excludes=["EXCLUDE THIS TEXT"])
         assert res == [0, 1]
 
+    def test_filter_pages_text_cache(self, tmp_path):
+        """Test a repeated filter reads page texts from the cache instead of extracting them again"""
+        mock_pdf_source = MagicMock()
+        mock_pdf_source.stream = io.BytesIO(b'%PDF-1.4 same content')
+        mock_pdf_source.pages = [MagicMock() for _ in range(3)]
+        for page, text in zip(mock_pdf_source.pages, ["INCLUDE THIS", "EXCLUDE THIS", "OTHER"]):
+            page.extract_text.return_value = text
+        mock_pdf_source.get_num_pages.return_value = 3
+        text_cache = PageTextCache(str(tmp_path / 'texts.db'))
+        assert PdfSplitting().filter_pages(mock_pdf_source, includes=["INCLUDE"], text_cache=text_cache) == [0]
+        for page in mock_pdf_source.pages:
+            page.extract_text.reset_mock()
+        assert CustomPDFSplitter().filter_pages(mock_pdf_source, includes=["INCLUDE", "OTHER"],
+                                                text_cache=text_cache) == [0, 2]
+        assert not any(page.extract_text.called for page in mock_pdf_source.pages)
+        text_cache.close()
+
+    def test_page_text_cache_evicts_least_recently_used(self, tmp_path):
+        """Test the cache drops the least recently used pages once it is over its size cap"""
+        text_cache = PageTextCache(str(tmp_path / 'texts.db'), max_bytes=20)
+        text_cache.put_many('a', {0: 'x' * 10})
+        text_cache.put_many('b', {0: 'y' * 10})
+        assert text_cache.get_many('a', [0]) == {0: 'x' * 10}
+        text_cache.put_many('c', {0: 'z' * 10})
+        assert text_cache.get_many('b', [0]) == {}
+        assert text_cache.get_many('a', [0]) == {0: 'x' * 10}
+        assert text_cache.get_many('c', [0]) == {0: 'z' * 10}
+        text_cache.close()
+
+    @pytest.mark.parametrize('multi_page_pdf', [
+        ({"file_name": "parallel_file.pdf", "text": ["INCLUDE PAGE 0", "EXCLUDE PAGE 1", "INCLUDE PAGE 2", "OTHER PAGE 3",
+                                                     "INCLUDE PAGE 4"]})
+    ], indirect=True)
+    @pytest.mark.parametrize('splitter', [PdfSplitting, CustomPDFSplitter])
+    def test_filter_pages_parallel(self, multi_page_pdf, splitter):
+        """Test extraction across worker processes keeps the page order of the serial filter"""
+        reader = PdfReader(multi_page_pdf)
+        serial = splitter.filter_pages(reader, includes=["INCLUDE"], excludes=["EXCLUDE"])
+        parallel = splitter.filter_pages(reader, includes=["INCLUDE"], excludes=["EXCLUDE"], jobs=2,
+                                         source_path=str(multi_page_pdf))
+        assert serial == parallel == [0, 2, 4]
+        texts = PdfSplitting.extract_page_texts(reader, [4, 0, 3], jobs=3, source_path=str(multi_page_pdf))
+        assert [texts[index].strip() for index in [4, 0, 3]] == ["INCLUDE PAGE 4", "INCLUDE PAGE 0", "OTHER PAGE 3"]
+
+    @pytest.mark.parametrize('multi_page_pdf', [
+        ({"file_name": "parallel_split.pdf", "text": [f"PAGE {num}" for num in range(7)]})
+    ], indirect=True)
+    def test_split_pdf_parallel(self, multi_page_pdf, tmp_path):
+        """Test parallel writing keeps the output names and their order"""
+        page_indices = [6, 1, 2, 4, 0]
+        res = PdfSplitting().split_pdf(multi_page_pdf, f'{tmp_path}', page_indices, jobs=3)
+        filename = os.path.split(multi_page_pdf)[1]
+        assert res == [f'{tmp_path}/{filename}'.replace(".pdf", f"_{index}.pdf") for index in range(5)]
+        assert [PdfReader(name).pages[0].extract_text().strip() for name in res] == \
+               [f"PAGE {num}" for num in page_indices]
+
+    @pytest.mark.parametrize('page_nums, page_ranges, pages_per_file, expected', [
+        ([0, 1, 2, 3, 4], None, None, [[0], [1], [2], [3], [4]]),
+        ([0, 1, 2, 3, 4], None, 2, [[0, 1], [2, 3], [4]]),
+        ([0, 2, 3, 4], [(0, 1), (2, 4)], None, [[0], [2, 3, 4]]),
+        ([0, 2, 3, 4], [(0, 1), (2, 4)], 2, [[0], [2, 3], [4]]),
+        ([2, 3], [(0, 1), (2, 3)], None, [[2, 3]]),
+    ])
+    def test_group_pages(self, page_nums, page_ranges, pages_per_file, expected):
+        """Test pages are grouped by range and/or by a fixed number of pages per file"""
+        assert PdfSplitting.group_pages(page_nums, page_ranges, pages_per_file) == expected
+
+    @pytest.mark.parametrize('multi_page_pdf', [
+        ({"file_name": "range_split.pdf", "text": [f"PAGE {num}" for num in range(6)]})
+    ], indirect=True)
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_split_pdf_page_ranges(self, multi_page_pdf, tmp_path, jobs):
+        """Test each page range is written to one file and ranges can be split into fixed size chunks"""
+        res = PdfSplitting().split_pdf(multi_page_pdf, f'{tmp_path}', jobs=jobs, page_ranges=[(0, 2), (3, 5)],
+                                       pages_per_file=2, excludes=["PAGE 4"])
+        assert [[page.extract_text().strip() for page in PdfReader(name).pages] for name in res] == \
+               [["PAGE 0", "PAGE 1"], ["PAGE 2"], ["PAGE 3", "PAGE 5"]]
+        filename = os.path.split(multi_page_pdf)[1]
+        assert res == [f'{tmp_path}/{filename}'.replace(".pdf", f"_{index}.pdf") for index in range(3)]
+
+    @pytest.mark.parametrize('multi_page_pdf', [
+        ({"file_name": "short_file.pdf", "text": ["PAGE 0", "PAGE 1"]})
+    ], indirect=True)
+    @pytest.mark.parametrize('kwargs', [{'page_indices': [0, 2]}, {'page_ranges': [(1, 3)]},
+                                        {'page_ranges': [(1, 0)]}, {'pages_per_file': 0}])
+    def test_split_pdf_invalid_pages(self, multi_page_pdf, tmp_path, kwargs):
+        """Test pages outside the input pdf and invalid groupings raise before anything is written"""
+        with pytest.raises(ValueError):
+            PdfSplitting().split_pdf(multi_page_pdf, f'{tmp_path}', **kwargs)
+        assert not os.listdir(tmp_path)
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_split_batch_manifest_and_resume(self, tmp_path, jobs):
+        """Test a batch splits the largest pdfs first into their own folders and a rerun skips finished inputs"""
+        in_folder = tmp_path / 'in'
+        in_folder.mkdir()
+        for name, pages in [('small.pdf', 1), ('large.pdf', 3)]:
+            pdf = canvas.Canvas(str(in_folder / name))
+            for num in range(pages):
+                pdf.drawString(100, 750, f"{name} PAGE {num}")
+                pdf.showPage()
+            pdf.save()
+        (in_folder / 'broken.pdf').write_bytes(b'not a pdf')
+        out_folder = tmp_path / 'out'
+        records = PdfSplitting().split_batch(str(in_folder), str(out_folder), jobs=jobs)
+        by_name = {os.path.split(record['input'])[1]: record for record in records}
+        assert {name: record['status'] for name, record in by_name.items()} == \
+               {'large.pdf': 'done', 'small.pdf': 'done', 'broken.pdf': 'failed'}
+        assert by_name['large.pdf']['outputs'] == [str(out_folder / 'large' / f'large_{index}.pdf') for index in range(3)]
+        if jobs == 1:
+            assert [os.path.split(record['input'])[1] for record in records][:2] == ['large.pdf', 'small.pdf']
+        with open(out_folder / 'manifest.jsonl') as manifest:
+            assert len(manifest.readlines()) == 3
+        rerun = PdfSplitting().split_batch(str(in_folder / '*.pdf'), str(out_folder), jobs=jobs)
+        assert [os.path.split(record['input'])[1] for record in rerun] == ['broken.pdf']
+
+    @pytest.mark.parametrize('multi_page_pdf', [
+        ({"file_name": "generator_split.pdf", "text": [f"PAGE {num}" for num in range(4)]})
+    ], indirect=True)
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_iter_split_pdf_in_memory(self, multi_page_pdf, tmp_path, jobs):
+        """Test the generator yields in memory outputs in order without writing files"""
+        outputs = list(PdfSplitting().iter_split_pdf(multi_page_pdf, page_indices=[3, 1, 0], jobs=jobs))
+        assert [index for index, _ in outputs] == [0, 1, 2]
+        assert [PdfReader(output).pages[0].extract_text().strip() for _, output in outputs] == \
+               ["PAGE 3", "PAGE 1", "PAGE 0"]
+        assert not os.listdir(tmp_path)
+
+    @pytest.mark.parametrize('multi_page_pdf', [
+        ({"file_name": "generator_split.pdf", "text": [f"PAGE {num}" for num in range(4)]})
+    ], indirect=True)
+    def test_iter_split_pdf_yields_each_file_when_written(self, multi_page_pdf, tmp_path):
+        """Test each output path is yielded before the next page is written"""
+        outputs = PdfSplitting().iter_split_pdf(multi_page_pdf, f'{tmp_path}')
+        index, output_name = next(outputs)
+        assert index == 0 and os.listdir(tmp_path) == [os.path.split(output_name)[1]]
+        assert len(list(outputs)) == 3
+
+    @pytest.mark.parametrize('multi_page_pdf', [
+        ({"file_name": "optimize_split.pdf", "text": [f"PAGE {num} " * 20 for num in range(3)]})
+    ], indirect=True)
+    def test_split_pdf_optimize_stats(self, multi_page_pdf, tmp_path):
+        """Test optimized outputs are smaller, keep their text and are reported in the stats"""
+        sizes = {}
+        for optimize in [False, True]:
+            splitter = PdfSplitting()
+            out_folder = tmp_path / str(optimize)
+            out_folder.mkdir()
+            res = splitter.split_pdf(multi_page_pdf, f'{out_folder}', pages_per_file=2, optimize=optimize)
+            sizes[optimize] = sum(os.path.getsize(name) for name in res)
+            assert splitter.stats['bytes_written'] == sizes[optimize]
+            assert (splitter.stats['files'], splitter.stats['pages']) == (2, 3)
+            assert splitter.stats['seconds_per_page'] == pytest.approx(splitter.stats['write_seconds'] / 3)
+            assert PdfReader(res[1]).pages[0].extract_text().strip() == ("PAGE 2 " * 20).strip()
+        assert sizes[True] < sizes[False]
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_split_batch_same_names(self, tmp_path, jobs):
+        """Test pdfs sharing a name in different folders get their own output folders"""
+        for folder, pages in [('a', 3), ('b', 2)]:
+            (tmp_path / 'in' / folder).mkdir(parents=True)
+            pdf = canvas.Canvas(str(tmp_path / 'in' / folder / 'doc.pdf'))
+            for num in range(pages):
+                pdf.drawString(100, 750, f"{folder} PAGE {num}")
+                pdf.showPage()
+            pdf.save()
+        out_folder = tmp_path / 'out'
+        records = PdfSplitting().split_batch(str(tmp_path / 'in' / '**' / '*.pdf'), str(out_folder), jobs=jobs)
+        outputs = {record['input']: record['outputs'] for record in records}
+        assert outputs[str(tmp_path / 'in' / 'a' / 'doc.pdf')] == \
+               [str(out_folder / 'a' / 'doc' / f'doc_{index}.pdf') for index in range(3)]
+        assert outputs[str(tmp_path / 'in' / 'b' / 'doc.pdf')] == \
+               [str(out_folder / 'b' / 'doc' / f'doc_{index}.pdf') for index in range(2)]
+        assert PdfReader(out_folder / 'b' / 'doc' / 'doc_1.pdf').pages[0].extract_text().strip() == "b PAGE 1"
+        assert sorted(os.listdir(out_folder / 'a' / 'doc')) == [f'doc_{index}.pdf' for index in range(3)]
+
+    @pytest.mark.parametrize('multi_page_pdf', [
+        ({"file_name": "legacy_override.pdf", "text": ["KEEP 0", "DROP 1", "KEEP 2"]})
+    ], indirect=True)
+    def test_split_pdf_legacy_filter_override(self, multi_page_pdf, tmp_path):
+        """Test a subclass overriding filter_pages with the original four parameters still splits"""
+        class LegacySplitter(PdfSplitting):
+            @staticmethod
+            def filter_pages(source, page_indices=None, includes=[], excludes=[]):
+                return [index for index in range(source.get_num_pages())
+                        if "KEEP" in source.pages[index].extract_text()]
+
+        res = LegacySplitter().split_pdf(multi_page_pdf, f'{tmp_path}', includes=["KEEP"])
+        assert [PdfReader(name).pages[0].extract_text().strip() for name in res] == ["KEEP 0", "KEEP 2"]
+
     ################################# Pytest Teardown Reference #########################################
     # def teardown_method(self, method):
     #     """Teardown for each test method."""